@@ -0,0 +1,126 @@
+import argparse
+import glob
+import os
+import sys
+import time
+import traceback
+from functools import partial
+
+import pandas as pd
+import matplotlib
+# Batches run headless, in worker processes with no display
+matplotlib.use('Agg')
+
+import batch_manifest as bm
+import cgm_grid as cgmg
+import cgm_ingest as cgmi
+import cgm_plot as cgm
+
+
+# Written into the batch output directory, alongside the lab trends manifest
+cgm_manifest_file = 'cgm_plots_manifest.json'
+
+# Figures rendered for every export
+cgm_figures = {
+    'plot': cgm.cgm_figure,
+    'heatmaps': cgm.cgm_heatmaps_figure,
+}
+
+
+def find_exports(inputs):
+    """Accepts a list of directories, glob patterns and file names and returns the CGM exports they name,
+    as absolute paths without duplicates"""
+    return bm.find_inputs(inputs, '.csv', lambda directory: glob.glob(os.path.join(directory, '*.csv')))
+
+def export_names(paths):
+    """Gives each export a name for its figures that's unique in the batch: the patient's name, or the export's
+    file name without the extension when another export is for the same patient, plus a hash of its path
+    when another export has the same file name too"""
+    return bm.unique_names(paths, [cgm.cgm_patient_name])
+
+def select_dates(df, start=None, end=None):
+    """The readings from the start date through the end date, either of which may be None for no limit"""
+    if start is not None:
+        df = df[df['Datetime'] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df['Datetime'] < pd.Timestamp(end) + pd.Timedelta(days=1)]
+    return df
+
+def render_export(path, output_dir, name, formats=('png',), start=None, end=None, dpi=150, step=None, max_gap=None):
+    """Renders the CGM figures for one export into output_dir in each format, named for name, from its readings on a grid
+    of step minutes with gaps longer than max_gap minutes (both as cgm_grid.regularize, None for the default).
+    Never raises: a failure is reported in the returned dict so the rest of the batch carries on"""
+    begin = time.time()
+    result = {'input': path, 'outputs': [], 'error': None}
+    try:
+        df = select_dates(cgmi.read_cgm(path), start, end)
+        if df['Glucose'].notna().sum() == 0:
+            raise ValueError('No glucose readings in the export for these dates')
+        # Every figure is drawn from the same grid
+        df = cgmg.regularize(df, step, max_gap)
+        for kind, make_figure in cgm_figures.items():
+            # The figures aren't made through pyplot, so nothing else holds on to them. Clearing each once it's
+            # saved closes it, and a worker's memory stays flat however many exports it renders
+            fig = make_figure(df)
+            for format in formats:
+                output = os.path.join(output_dir, cgm.cgm_plot_file(path, df, kind, format, name))
+                fig.savefig(output, dpi=dpi)
+                result['outputs'].append(output)
+            fig.clear()
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['seconds'] = time.time() - begin
+    return result
+
+def batch_settings(formats, start, end, dpi, step=None, max_gap=None):
+    """Everything besides the export itself that the outputs depend on"""
+    return {'formats': list(formats), 'start': start, 'end': end, 'dpi': dpi, 'step': step, 'max_gap': max_gap}
+
+def run_batch(paths, output_dir, jobs=None, formats=('png',), start=None, end=None, dpi=150, progress=print, force=False,
+              step=None, max_gap=None):
+    """Renders the CGM exports in paths with a pool of jobs processes (all cores if None) and
+    returns one result dict per export, in the order they finished.
+    Exports the output directory's manifest shows as already rendered are skipped unless force is set"""
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Named before any are skipped, so an export keeps its name from one run to the next
+    names = export_names(paths)
+    process = partial(render_export, output_dir=output_dir, formats=formats, start=start, end=end, dpi=dpi, step=step, max_gap=max_gap)
+    return bm.run_batch(paths, names, os.path.join(output_dir, cgm_manifest_file),
+                        batch_settings(formats, start, end, dpi, step, max_gap), process, jobs, progress, force)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Render CGM profile plots and heatmaps for a folder of CGM exports.')
+    parser.add_argument('inputs', nargs='+', help='directories, glob patterns or .csv exports to render')
+    parser.add_argument('-o', '--output-dir', default='.', help='where to write the figures (default: the current directory)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (default: one per core)')
+    parser.add_argument('-f', '--force', action='store_true', help='rerender every export, even those the manifest shows as up to date')
+    parser.add_argument('--format', dest='formats', action='append', choices=['png', 'svg'],
+                        help='figure format, may be given more than once (default: png)')
+    parser.add_argument('--start', help='first date to include, e.g. 2024-01-01')
+    parser.add_argument('--end', help='last date to include, e.g. 2024-03-31')
+    parser.add_argument('--dpi', type=int, default=150, help='resolution of PNG figures (default: 150)')
+    parser.add_argument('--step', type=int, choices=cgmg.grid_steps, help="grid spacing in minutes (default: the export's own)")
+    parser.add_argument('--max-gap', type=int, help='longest stretch without readings to interpolate across, in minutes')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = find_exports(args.inputs)
+    if not paths:
+        print('No CGM exports found', file=sys.stderr)
+        return 1
+
+    results = run_batch(paths, args.output_dir, args.jobs, args.formats or ['png'], args.start, args.end, args.dpi, force=args.force,
+                        step=args.step, max_gap=args.max_gap)
+
+    failed = [result for result in results if result['error']]
+    for result in failed:
+        print(f"\n{result['input']} failed:\n{result['error']}", file=sys.stderr)
+    print(f'{len(results) - len(failed)} rendered, {len(failed)} failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
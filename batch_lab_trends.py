@@ -0,0 +1,100 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import traceback
+from functools import partial
+from pathlib import Path
+
+import batch_manifest as bm
+import convert_lab_trends as clt
+import make_trends_pretty as mtp
+
+
+def find_workbooks(inputs):
+    """Accepts a list of directories, glob patterns and file names and returns the lab trends workbooks they name,
+    as absolute paths without duplicates"""
+    return bm.find_inputs(inputs, '.xlsx', clt.list_lab_trends_files)
+
+def workbook_names(paths):
+    """Gives each workbook a name for its outputs that's unique in the batch: its file name without the extension,
+    plus a hash of its path when another workbook in the batch has the same file name"""
+    return bm.unique_names(paths)
+
+def pretty_trends_file(name):
+    return f'{name}_pretty_trends.html'
+
+def process_workbook(path, output_dir, name, linked_assets=False):
+    """Runs convert_lab_trends and make_trends_pretty on one workbook. convert_lab_trends writes to the working
+    directory, so it runs in a folder of its own under output_dir, named for the workbook, where nothing another
+    workbook writes can collide with it. The pretty trends go in output_dir itself, next to any shared assets.
+    Never raises: a failure is reported in the returned dict so the rest of the batch carries on"""
+    start = time.time()
+    result = {'input': path, 'outputs': [], 'error': None}
+    cwd = os.getcwd()
+    try:
+        workbook_dir = os.path.join(output_dir, name)
+        os.makedirs(workbook_dir, exist_ok=True)
+        os.chdir(workbook_dir)
+        # Both pipelines print as they go, which would bury the progress lines
+        with contextlib.redirect_stdout(io.StringIO()):
+            outputs = clt.main(Path(path))
+            report = mtp.report_df(path)
+        html_file = os.path.join(output_dir, pretty_trends_file(name))
+        mtp.save_html_to_file(report, html_file, linked_assets)
+        result['outputs'] = [os.path.abspath(f) for f in outputs + [html_file]]
+    except Exception:
+        result['error'] = traceback.format_exc()
+    finally:
+        os.chdir(cwd)
+    result['seconds'] = time.time() - start
+    return result
+
+def batch_settings(linked_assets):
+    """Everything besides the workbook itself that the outputs depend on"""
+    return {'ranges_hash': bm.file_hash(clt.ideal_lab_ranges_file), 'linked_assets': linked_assets}
+
+def run_batch(paths, output_dir, jobs=None, linked_assets=False, progress=print, force=False):
+    """Processes the workbooks in paths with a pool of jobs processes (all cores if None) and
+    returns one result dict per workbook, in the order they finished.
+    Workbooks the output directory's manifest shows as already converted are skipped unless force is set"""
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    if linked_assets:
+        mtp.write_report_assets(output_dir)
+
+    # Named before any are skipped, so a workbook keeps its name from one run to the next
+    names = workbook_names(paths)
+    process = partial(process_workbook, output_dir=output_dir, linked_assets=linked_assets)
+    return bm.run_batch(paths, names, os.path.join(output_dir, bm.manifest_file), batch_settings(linked_assets), process,
+                        jobs, progress, force)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Convert a folder of lab trends workbooks to CSV, markdown and pretty HTML.')
+    parser.add_argument('inputs', nargs='+', help='directories, glob patterns or .xlsx files to convert')
+    parser.add_argument('-o', '--output-dir', default='.', help='where to write the outputs (default: the current directory)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes (default: one per core)')
+    parser.add_argument('-f', '--force', action='store_true', help='reconvert every workbook, even those the manifest shows as up to date')
+    parser.add_argument('--linked-assets', action='store_true', help='write one shared stylesheet and script instead of embedding them in every report')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = find_workbooks(args.inputs)
+    if not paths:
+        print('No lab trends workbooks found', file=sys.stderr)
+        return 1
+
+    results = run_batch(paths, args.output_dir, args.jobs, args.linked_assets, force=args.force)
+
+    failed = [result for result in results if result['error']]
+    for result in failed:
+        print(f"\n{result['input']} failed:\n{result['error']}", file=sys.stderr)
+    print(f'{len(results) - len(failed)} converted, {len(failed)} failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import glob
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import trends_cache as tc
+
+
+# Written into the batch output directory
+manifest_file = 'lab_trends_manifest.json'
+
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+def file_hash(path):
+    """Returns the content hash of the file, or None if it doesn't exist"""
+    try:
+        return tc.content_hash(tc.read_file_bytes(path))
+    except OSError:
+        return None
+
+
+class BatchManifest:
+    """Record of what each input workbook produced last time, so a rerun of the batch only has to
+    process workbooks that are new or changed since, or whose outputs are missing.
+    Every entry also remembers the ranges file and the options it was built with, since changing either
+    changes the outputs"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_current(self, input_path, settings):
+        """True if input_path was processed with these settings and hasn't changed since.
+        The workbook is only hashed when its mtime or size has moved, and an unchanged hash just refreshes the stamp"""
+        entry = self.entries.get(input_path)
+        if entry is None or entry['settings'] != settings:
+            return False
+        if not all(os.path.exists(output) for output in entry['outputs']):
+            return False
+
+        try:
+            stamp = list(file_stamp(input_path))
+        except OSError:
+            return False
+        if stamp == entry['stamp']:
+            return True
+        if file_hash(input_path) != entry['hash']:
+            return False
+        entry['stamp'] = stamp
+        return True
+
+    def record(self, input_path, outputs, settings):
+        self.entries[input_path] = {
+            'hash': file_hash(input_path),
+            'stamp': list(file_stamp(input_path)),
+            'outputs': outputs,
+            'settings': settings,
+        }
+
+    def forget(self, input_path):
+        self.entries.pop(input_path, None)
+
+    def save(self):
+        # Write to a temporary file first so an interrupted batch never leaves a half-written manifest
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+
+def find_inputs(inputs, extension, list_dir):
+    """Accepts a list of directories, glob patterns and file names and returns the files they name, as absolute paths
+    without duplicates. Directories are listed with list_dir, and glob patterns only match files with the extension"""
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            found.extend(sorted(list_dir(item)))
+        elif glob.has_magic(item):
+            found.extend(sorted(f for f in glob.glob(item) if f.lower().endswith(extension)))
+        else:
+            found.append(item)
+    return list(dict.fromkeys(os.path.abspath(f) for f in found))
+
+def unique_names(paths, namers=()):
+    """Gives each input a name for its outputs that's unique in the batch: the first of namers (functions of the path)
+    that names no other input the same, else its file name without the extension, plus a hash of its path
+    when another input has the same file name too"""
+    namers = list(namers) + [lambda path: Path(path).stem]
+    candidates = [[namer(path) for path in paths] for namer in namers]
+    names = {}
+    for index, path in enumerate(paths):
+        for batch_names in candidates:
+            if batch_names.count(batch_names[index]) == 1:
+                names[path] = batch_names[index]
+                break
+        else:
+            names[path] = f'{Path(path).stem}_{tc.content_hash(path.encode())[:8]}'
+    return names
+
+def run_batch(paths, names, manifest_path, settings, process, jobs=None, progress=print, force=False):
+    """Calls process(path, name=names[path]) for each input in paths with a pool of jobs processes (all cores if None),
+    and returns the result dicts it gives back ({'input', 'outputs', 'error', 'seconds'}) in the order they finished.
+    process must never raise, and must be picklable, e.g. a functools.partial of a module level function.
+    Inputs the manifest shows as already processed with these settings are skipped unless force is set"""
+    manifest = BatchManifest(manifest_path)
+    if not force:
+        skipped = {path for path in paths if manifest.is_current(path, settings)}
+        if skipped:
+            progress(f'{len(skipped)} unchanged, skipping')
+            paths = [path for path in paths if path not in skipped]
+
+    results = []
+    def report(result):
+        results.append(result)
+        # Save as we go so an interrupted batch still keeps what it finished
+        if result['error']:
+            manifest.forget(result['input'])
+        else:
+            manifest.record(result['input'], result['outputs'], settings)
+        manifest.save()
+        status = 'FAILED' if result['error'] else 'ok'
+        progress(f"[{len(results)}/{len(paths)}] {status} {os.path.basename(result['input'])} ({result['seconds']:.1f}s)")
+
+    if not paths:
+        manifest.save()
+        return results
+
+    if jobs == 1:
+        for path in paths:
+            report(process(path, name=names[path]))
+        return results
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(process, path, name=names[path]): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # A worker died outright (e.g. out of memory), which takes its input down with it
+                result = {'input': futures[future], 'outputs': [], 'error': traceback.format_exc(), 'seconds': 0.0}
+            report(result)
+    return results
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+
+# Spacing of the regular grid readings are put on, in minutes, when it can't be worked out from the readings.
+# Most sensors read every 5 minutes
+grid_minutes = 5
+
+# The spacings a grid can have. Each divides an hour, so the grid stays aligned to the clock
+grid_steps = [1, 2, 3, 4, 5, 6, 10, 12, 15, 20, 30, 60]
+
+# Longest stretch between two readings that's interpolated across, in minutes, or three grid steps on coarser grids.
+# Anything longer is left as a gap
+max_gap_minutes = 15
+max_gap_steps = 3
+
+nanoseconds_per_minute = 60 * 10**9
+
+
+def grid_points(minutes, step=grid_minutes):
+    """The odd number of grid points closest to spanning the given minutes, for smoothing windows"""
+    points = max(int(round(minutes / step)), 1)
+    return points if points % 2 else points + 1
+
+def sampling_minutes(datetimes):
+    """The usual spacing of the readings: the median time between them, rounded to the nearest of grid_steps.
+    grid_minutes if there are too few readings to tell"""
+    times = np.unique(pd.DatetimeIndex(datetimes).dropna().asi8)
+    if len(times) < 2:
+        return grid_minutes
+    minutes = np.median(np.diff(times)) / nanoseconds_per_minute
+    return min(grid_steps, key=lambda step: abs(step - minutes))
+
+def grid_step(df):
+    """The spacing in minutes of readings that have been through regularize"""
+    return sampling_minutes(df['Datetime'])
+
+def regularize(df, step=None, max_gap=None):
+    """Accepts CGM readings ('Datetime' and 'Glucose' columns, in any order, possibly irregular or repeated)
+    and returns them on a grid every step minutes, aligned to the clock, from the grid point nearest the first reading
+    to the one nearest the last, so both of those are Measured.
+    step is one of grid_steps and defaults to the spacing of the readings (so 1-minute data keeps every reading).
+    Each grid point takes the nearest reading within half a step of it, marked True in the 'Measured' column,
+    or failing that the glucose interpolated between the readings either side. Where those readings are more than
+    max_gap minutes apart (by default max_gap_minutes or max_gap_steps steps, whichever is longer) the point is left
+    as NaN and marked True in the 'Gap' column"""
+    readings = df.dropna(subset=['Datetime', 'Glucose'])
+    times = readings['Datetime'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    glucose = readings['Glucose'].to_numpy(dtype=float)
+    if len(times) == 0:
+        return pd.DataFrame({'Datetime': pd.Series(dtype='datetime64[ns]'), 'Glucose': pd.Series(dtype='float64'),
+                             'Measured': pd.Series(dtype=bool), 'Gap': pd.Series(dtype=bool)})
+
+    # Sort the readings and average any that share a timestamp
+    times, inverse = np.unique(times, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    glucose = np.bincount(inverse, glucose) / np.bincount(inverse)
+
+    if step is None:
+        step = sampling_minutes(times)
+    if step not in grid_steps:
+        raise ValueError(f'The grid step must be one of {grid_steps} minutes, not {step}')
+    if max_gap is None:
+        max_gap = max(max_gap_minutes, max_gap_steps * step)
+
+    step_ns = step * nanoseconds_per_minute
+    # The grid points nearest the first and last readings, which may be just before or after them
+    start, end = (times[[0, -1]] + step_ns // 2) // step_ns * step_ns
+    grid = np.arange(start, end + 1, step_ns)
+
+    # The readings at or just after and just before each grid point
+    after = np.minimum(np.searchsorted(times, grid), len(times) - 1)
+    before = np.maximum(after - 1, 0)
+
+    # Snap readings to their grid point rather than blending neighbours, which would smooth away real swings
+    nearest = np.where(grid - times[before] < times[after] - grid, before, after)
+    snapped = np.abs(times[nearest] - grid) * 2 <= step_ns
+    gap = ~snapped & (times[after] - times[before] > max_gap * nanoseconds_per_minute)
+    values = np.where(snapped, glucose[nearest], np.interp(grid, times, glucose))
+    values[gap] = np.nan
+    return pd.DataFrame({'Datetime': pd.to_datetime(grid), 'Glucose': values, 'Measured': snapped, 'Gap': gap})
+
+def gridded(df):
+    """The readings on the regular grid: df itself if it has already been through regularize
+    (it has a 'Gap' column), so callers can regularize once and pass the grid down"""
+    return df if 'Gap' in df else regularize(df)
@@ -0,0 +1,131 @@
+import os
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+import cgm_schema as cgms
+import results_cache as rcache
+import trends_cache as tc
+
+
+# Rows parsed at a time, so a year of one-minute readings never has to be held as text all at once
+cgm_chunk_rows = 100_000
+
+# Dexcom Clarity exports, e.g. 2024-03-01T08:05:17
+timestamp_format = '%Y-%m-%dT%H:%M:%S'
+
+# Bumped whenever the way exports are parsed changes, so older sidecars are parsed again
+sidecar_version = 2
+
+
+def parse_timestamps(text, format=timestamp_format):
+    """Parses timestamp strings with the fixed format, falling back to guessing the format
+    only for the strings that don't match it"""
+    datetimes = pd.to_datetime(text, format=format, errors='coerce')
+    unparsed = datetimes.isna() & text.notna() & (text.str.strip() != '')
+    if unparsed.any():
+        datetimes[unparsed] = pd.to_datetime(text[unparsed], format='mixed', errors='coerce')
+    return datetimes
+
+def read_head(source):
+    """The start of a CGM export (its bytes or a path), as much as cgm_schema.detect_layout looks at"""
+    if isinstance(source, bytes):
+        return source
+    with open(source, 'rb') as f:
+        # One byte more than the sample, so detect_layout can tell the sample's last line may be cut off
+        return f.read(cgms.sample_bytes + 1)
+
+def parse_cgm_csv(source, layout=None, chunk_rows=cgm_chunk_rows):
+    """Reads just the timestamp and glucose columns of a CGM export (its bytes or a path), a chunk at a time.
+    The columns come from the layout, which is detected from the first rows of the export if not given.
+    Returns a DataFrame of 'Datetime' and a float 'Glucose' in mg/dL (NaN for readings like 'Low' or for event rows),
+    leaving out rows without a timestamp"""
+    if layout is None:
+        layout = cgms.detect_layout(read_head(source))
+
+    # usecols keeps the columns in file order
+    columns = sorted(set([layout['timestamp_column']] + layout['glucose_columns']))
+    chunks = []
+    csv_file = BytesIO(source) if isinstance(source, bytes) else source
+    for chunk in pd.read_csv(csv_file, skiprows=layout['header_row'], usecols=columns, dtype=str, chunksize=chunk_rows):
+        # A reading comes from the first of the glucose columns that has one
+        glucose = None
+        for column in layout['glucose_columns']:
+            values = pd.to_numeric(chunk.iloc[:, columns.index(column)], errors='coerce').astype('float64')
+            glucose = values if glucose is None else glucose.fillna(values)
+        parsed = pd.DataFrame({
+            'Datetime': parse_timestamps(chunk.iloc[:, columns.index(layout['timestamp_column'])], layout['format']),
+            'Glucose': glucose * layout['scale'] if layout['scale'] != 1 else glucose,
+        })
+        chunks.append(parsed[parsed['Datetime'].notna()])
+    if not chunks:
+        return pd.DataFrame({'Datetime': pd.Series(dtype='datetime64[ns]'), 'Glucose': pd.Series(dtype='float64')})
+    return pd.concat(chunks, ignore_index=True)
+
+def to_sidecar(df):
+    """Packs the readings into the sidecar's columns: nanoseconds since the epoch as int64 and glucose as a
+    nullable int16 (float32 if the export has fractional readings, e.g. mmol/L)"""
+    glucose = df['Glucose']
+    readings = glucose.dropna()
+    fits_int16 = (readings == readings.round()).all() and (readings.abs() < 2**15).all()
+    glucose = glucose.astype('Int16') if fits_int16 else glucose.astype('float32')
+    return pd.DataFrame({'timestamp': df['Datetime'].to_numpy(dtype='datetime64[ns]').view(np.int64), 'glucose': glucose})
+
+def from_sidecar(table):
+    return pd.DataFrame({
+        'Datetime': pd.to_datetime(table['timestamp'].to_numpy(dtype=np.int64)),
+        'Glucose': table['glucose'].astype('float64').to_numpy(dtype=float, na_value=np.nan),
+    })
+
+def sidecar_path(file, key):
+    """Sidecars sit next to CGM files on disk; uploads, which have no path, go in the results cache"""
+    if isinstance(file, (str, os.PathLike)):
+        return f'{os.fspath(file)}.cgm.parquet'
+    return os.path.join(rcache.results_cache_dir, f'{key}.cgm.parquet')
+
+def read_sidecar(path, key):
+    try:
+        table = pd.read_parquet(path)
+    except (OSError, ValueError):
+        return None
+    if table.attrs.get('source_hash') != key or table.attrs.get('sidecar_version') != sidecar_version:
+        return None
+    return from_sidecar(table)
+
+def write_sidecar(path, key, df):
+    table = to_sidecar(df)
+    table.attrs['source_hash'] = key
+    table.attrs['sidecar_version'] = sidecar_version
+    # The sidecar only saves the next parse, so a read-only folder isn't an error
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        table.to_parquet(f'{path}.tmp', index=False)
+        os.replace(f'{path}.tmp', path)
+    except OSError:
+        pass
+
+def read_cgm(csv_file):
+    """Returns the readings in a CGM export (a path or an upload) as 'Datetime' and 'Glucose' columns.
+    The CSV is only parsed the first time a given file content is seen; after that the readings come from its Parquet sidecar.
+    Files on disk are hashed and parsed straight from the file, without reading it all into memory"""
+    if isinstance(csv_file, (str, os.PathLike)):
+        source = csv_file
+        key = tc.file_content_hash(csv_file)
+    else:
+        source = tc.read_file_bytes(csv_file)
+        key = tc.content_hash(source)
+    path = sidecar_path(csv_file, key)
+
+    df = read_sidecar(path, key)
+    if df is None:
+        df = parse_cgm_csv(source)
+        write_sidecar(path, key, df)
+    return df
+
+def cgm_readings(source):
+    """Accepts a CGM export (a path or an upload) or readings already loaded, e.g. a window of a patient's
+    history from cgm_store, and returns the readings as 'Datetime' and 'Glucose' columns"""
+    if isinstance(source, pd.DataFrame):
+        return source
+    return read_cgm(source)
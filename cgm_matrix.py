@@ -0,0 +1,182 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+minutes_per_day = 1440
+
+# The quantiles of the daily glucose profile
+profile_quantiles = [0.10, 0.34, 0.50, 0.68, 0.90]
+
+
+class MinuteMatrix:
+    """CGM readings laid out as a day x minute-of-day array, NaN where there's no reading.
+    A reading that lands in a minute already taken that day (a duplicate, or the repeated hour when the clocks
+    go back) is kept in an overflow row after the day rows, so per-minute statistics still see every reading.
+    overflow_days holds the index into days of the day each overflow reading was taken on, -1 where there's none"""
+
+    def __init__(self, values, days, overflow_days=None):
+        self.values = values
+        self.days = days
+        if overflow_days is None:
+            overflow_days = np.full((len(values) - len(days), minutes_per_day), -1, dtype=np.int64)
+        self.overflow_days = overflow_days
+
+    @property
+    def day_values(self):
+        """Just the day rows, one per entry in days"""
+        return self.values[:len(self.days)]
+
+    @property
+    def cell_days(self):
+        """The index into days of the day each cell of values belongs to, -1 for empty overflow cells"""
+        day_rows = np.broadcast_to(np.arange(len(self.days))[:, None], (len(self.days), minutes_per_day))
+        return np.concatenate([day_rows, self.overflow_days])
+
+    def where(self, keep):
+        """Returns a copy with the readings outside keep set to NaN"""
+        return MinuteMatrix(np.where(keep, self.values, np.nan), self.days, self.overflow_days)
+
+
+def minute_of_day(datetimes):
+    datetimes = pd.DatetimeIndex(datetimes)
+    return np.asarray(datetimes.hour * 60 + datetimes.minute, dtype=np.int64)
+
+def minute_matrix(datetimes, glucose):
+    """Accepts matching sequences of reading times and glucose values and returns them as a MinuteMatrix.
+    Readings without a time or a numeric value are left out"""
+    datetimes = pd.DatetimeIndex(datetimes)
+    values = pd.to_numeric(pd.Series(np.asarray(glucose)), errors='coerce').to_numpy(dtype=float)
+    present = ~np.isnan(values) & ~datetimes.isna()
+    datetimes = datetimes[present]
+    values = values[present]
+
+    minutes = minute_of_day(datetimes)
+    days, day_rows = np.unique(datetimes.normalize().to_numpy(), return_inverse=True)
+    day_rows = day_rows.reshape(-1)
+
+    # The first reading in each day and minute goes in that day's row, any others in overflow rows
+    rows = day_rows.copy()
+    cells = day_rows * minutes_per_day + minutes
+    order = np.argsort(cells, kind='stable')
+    repeated = np.zeros(len(cells), dtype=bool)
+    repeated[order[1:]] = cells[order[1:]] == cells[order[:-1]]
+    if repeated.any():
+        overflow_minutes = minutes[repeated]
+        overflow_rank = pd.Series(overflow_minutes).groupby(overflow_minutes).cumcount().to_numpy()
+        rows[repeated] = len(days) + overflow_rank
+
+    n_rows = rows.max() + 1 if len(rows) else 0
+    matrix = np.full((n_rows, minutes_per_day), np.nan)
+    matrix[rows, minutes] = values
+    overflow_days = np.full((n_rows - len(days), minutes_per_day), -1, dtype=np.int64)
+    overflow_days[rows[repeated] - len(days), minutes[repeated]] = day_rows[repeated]
+    return MinuteMatrix(matrix, pd.DatetimeIndex(days), overflow_days)
+
+def nan_quantiles(values, quantiles, keepdims=False):
+    """Quantiles down the rows of a (row x minute) array, or of each (row x minute) block of a (period x row x minute) stack"""
+    # Minutes without any readings give all-NaN columns, which is expected rather than worth a warning
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanquantile(values, quantiles, axis=-2, keepdims=keepdims)
+
+def nan_max(values):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmax(values, axis=-2)
+
+def outlier_mask(values, lower=0.34, upper=0.68, k=1.5):
+    """True for the readings that are within k times the spread between the lower and upper quantiles
+    of the other readings at the same minute of the day"""
+    q1, q3 = nan_quantiles(values, [lower, upper], keepdims=True)
+    iqr = q3 - q1
+    with np.errstate(invalid='ignore'):
+        return (values >= q1 - k * iqr) & (values <= q3 + k * iqr)
+
+def remove_outliers(matrix, lower=0.34, upper=0.68, k=1.5):
+    """Drops the readings in each minute of the day that are more than k times the spread between
+    the lower and upper quantiles below or above it"""
+    return matrix.where(outlier_mask(matrix.values, lower, upper, k))
+
+def quantile_profile(matrix, quantiles=profile_quantiles):
+    """Returns a DataFrame of the glucose quantiles at each minute of the day, indexed by minute
+    and with a column per quantile. Minutes without readings are left out"""
+    profile = pd.DataFrame(nan_quantiles(matrix.values, quantiles).T, columns=quantiles)
+    profile.index.name = 'Minutes'
+    return profile.dropna(how='all')
+
+def max_profile(matrix):
+    """Returns the highest reading at each minute of the day as a Series indexed by minute, leaving out minutes without readings"""
+    profile = pd.Series(nan_max(matrix.values), name='Glucose')
+    profile.index.name = 'Minutes'
+    return profile.dropna()
+
+def period_bounds(period):
+    """Accepts a (start, end) pair of dates and returns the timestamps from the start of the first day
+    to the end of the last"""
+    start, end = period
+    return pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+
+def period_label(period):
+    start, end = period
+    return f"{pd.Timestamp(start).strftime('%m/%d/%Y')} to {pd.Timestamp(end).strftime('%m/%d/%Y')}"
+
+def period_stack(datetimes, glucose, periods):
+    """Lays out the readings of each (start, end) period as its own MinuteMatrix and stacks them into one
+    (period x row x minute) array, padding the shorter periods with rows of NaN. Periods may overlap"""
+    datetimes = pd.DatetimeIndex(datetimes)
+    glucose = np.asarray(glucose)
+    blocks = []
+    for period in periods:
+        start, end = period_bounds(period)
+        in_period = np.asarray((datetimes >= start) & (datetimes < end))
+        blocks.append(minute_matrix(datetimes[in_period], glucose[in_period]).values)
+
+    stack = np.full((len(blocks), max([len(block) for block in blocks], default=0), minutes_per_day), np.nan)
+    for i, block in enumerate(blocks):
+        stack[i, :len(block)] = block
+    return stack
+
+def period_profiles(stack, periods, quantiles=profile_quantiles, remove_outliers=True):
+    """Returns the quantile profile of every period in the stack from a single pass over it, as a DataFrame
+    indexed by minute with a (period label, quantile) column for each. Each period's outliers are removed first,
+    as for a single profile"""
+    if remove_outliers:
+        stack = np.where(outlier_mask(stack), stack, np.nan)
+    values = nan_quantiles(stack, quantiles)
+    profiles = pd.DataFrame(
+        values.transpose(2, 1, 0).reshape(minutes_per_day, -1),
+        columns=pd.MultiIndex.from_product([[period_label(period) for period in periods], quantiles]),
+    )
+    profiles.index.name = 'Minutes'
+    return profiles
+
+# Glucose the heatmaps' colors run between, fixed so heatmaps of different patients can be compared
+heatmap_glucose_range = (54, 250)
+
+weekday_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+def binned_day_values(matrix, step):
+    """The day rows with each step minutes averaged into one column, giving a (day x minutes_per_day / step) array"""
+    values = matrix.day_values.reshape(len(matrix.days), minutes_per_day // step, step)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(values, axis=2)
+
+def weekday_hour_medians(matrix):
+    """Returns the median glucose for each weekday and hour of the day as a DataFrame indexed by weekday name
+    with a column per hour. Every reading, overflow rows included, is stacked by weekday into one
+    (weekday x reading x hour x minute) array, so all 168 medians are a single nanmedian"""
+    present = ~np.isnan(matrix.values)
+    minutes = np.nonzero(present)[1]
+    weekdays = np.asarray(matrix.days.weekday)[matrix.cell_days[present]]
+    # Each reading takes the next free row for its weekday and minute
+    cells = weekdays * minutes_per_day + minutes
+    rank = pd.Series(cells).groupby(cells).cumcount().to_numpy()
+    stack = np.full((7, rank.max() + 1 if len(rank) else 0, minutes_per_day), np.nan)
+    stack[weekdays, rank, minutes] = matrix.values[present]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        medians = np.nanmedian(stack.reshape(7, -1, 24, 60), axis=(1, 3))
+    return pd.DataFrame(medians, index=weekday_names, columns=range(24))
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+import cgm_matrix as cgmm
+
+
+# Consensus glucose ranges in mg/dL, lowest first
+glucose_bands = ['Very Low (<54)', 'Low (54-69)', 'In Range (70-180)', 'High (181-250)', 'Very High (>250)']
+
+# Percentiles of the ambulatory glucose profile
+agp_quantiles = [0.05, 0.25, 0.50, 0.75, 0.95]
+
+
+def band_index(values):
+    """Returns the index into glucose_bands of each reading"""
+    return (values >= 54).astype(np.int64) + (values >= 70) + (values > 180) + (values > 250)
+
+def turning_points(values, threshold):
+    """Returns the peaks and nadirs of the readings, in order, ignoring any reversal of threshold or less.
+    A small dip on the way up (or bump on the way down) doesn't end an excursion; it only ends once the readings
+    have come back more than threshold from the highest (or lowest) point so far"""
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) < 2:
+        return values[:0]
+
+    # Only the local extremes can be turning points, so drop repeats and the readings partway up or down a slope
+    values = values[np.r_[True, np.diff(values) != 0]]
+    direction = np.sign(np.diff(values))
+    values = values[np.r_[True, direction[1:] != direction[:-1], True]]
+
+    points = []
+    low = high = values[0]
+    rising = None
+    candidate = None
+    for value in values[1:]:
+        if rising is None:
+            # Until the first excursion the lowest and highest readings so far are both candidates
+            low = min(low, value)
+            high = max(high, value)
+            if value - low > threshold:
+                points.append(low)
+                rising, candidate = True, value
+            elif high - value > threshold:
+                points.append(high)
+                rising, candidate = False, value
+        elif rising:
+            if value > candidate:
+                candidate = value
+            elif candidate - value > threshold:
+                points.append(candidate)
+                rising, candidate = False, value
+        else:
+            if value < candidate:
+                candidate = value
+            elif value - candidate > threshold:
+                points.append(candidate)
+                rising, candidate = True, value
+
+    if candidate is not None and abs(candidate - points[-1]) > threshold:
+        points.append(candidate)
+    return np.array(points)
+
+def excursions(values, sd, gap=None):
+    """The amplitude of each rise and fall between the turning points of the readings larger than one SD.
+    gap, if given, is True where there's a gap in the readings; no excursion is counted across one"""
+    values = np.asarray(values, dtype=float)
+    if gap is None:
+        return np.abs(np.diff(turning_points(values, sd)))
+    gap = np.asarray(gap, dtype=bool)
+    # Number the runs of readings between gaps and find the turning points of each run on its own
+    run = np.cumsum(gap)[~gap]
+    runs = np.split(values[~gap], np.flatnonzero(np.diff(run)) + 1)
+    return np.concatenate([np.abs(np.diff(turning_points(part, sd))) for part in runs])
+
+def mage(values, sd, gap=None):
+    """Mean amplitude of glycemic excursions: the average rise or fall between consecutive peaks and nadirs,
+    where a peak or nadir only counts once the readings have reversed by more than one standard deviation.
+    Excursions don't span the points where gap is True"""
+    amplitudes = excursions(values, sd, gap)
+    return amplitudes.mean() if len(amplitudes) else np.nan
+
+def glucose_metrics(df):
+    """Accepts CGM readings ('Datetime' and 'Glucose' columns) and returns a dict of summary metrics:
+    mean, SD, CV, GMI, MAGE, percent of readings above 100 and 140 mg/dL and percent in each of glucose_bands.
+    Readings regularized onto a grid count only the points that took a real reading, keep MAGE from spanning
+    the gaps and also give the percent of the time covered by the sensor"""
+    df = df.sort_values('Datetime')
+    glucose = df['Glucose'].to_numpy(dtype=float)
+    values = glucose[~np.isnan(glucose)]
+    count = len(values)
+    if count == 0:
+        return {'Readings': 0}
+
+    mean = values.mean()
+    sd = values.std(ddof=1) if count > 1 else np.nan
+    metrics = {
+        'Readings': int(df['Measured'].sum()) if 'Measured' in df else count,
+        'Mean': mean,
+        'SD': sd,
+        'CV %': 100 * sd / mean,
+        'GMI %': 3.31 + 0.02392 * mean,
+        'MAGE': mage(glucose, sd, df['Gap'].to_numpy() if 'Gap' in df else None),
+        'Time >100 %': 100 * (values > 100).mean(),
+        'Time >140 %': 100 * (values > 140).mean(),
+    }
+    in_band = np.bincount(band_index(values), minlength=len(glucose_bands))
+    for label, n in zip(glucose_bands, in_band):
+        metrics[f'{label} %'] = 100 * n / count
+    if 'Gap' in df:
+        metrics['Coverage %'] = 100 * (~df['Gap']).mean()
+    return metrics
+
+def agp_percentiles(df, quantiles=agp_quantiles):
+    """Returns the ambulatory glucose profile: the 5th, 25th, 50th, 75th and 95th percentile of the readings
+    at each minute of the day, indexed by minute"""
+    matrix = cgmm.minute_matrix(df['Datetime'], df['Glucose'])
+    return cgmm.quantile_profile(matrix, quantiles)
+
+def metrics_frame(metrics):
+    """The metrics dict as a one-column DataFrame, for tables and batch summaries"""
+    return pd.DataFrame({'Value': pd.Series(metrics, dtype=float)})
+
+def period_metrics(df, periods):
+    """Returns glucose_metrics for each (start, end) period of the readings as a DataFrame with a column per period"""
+    metrics = {}
+    for period in periods:
+        start, end = cgmm.period_bounds(period)
+        metrics[cgmm.period_label(period)] = glucose_metrics(df[(df['Datetime'] >= start) & (df['Datetime'] < end)])
+    return pd.DataFrame(metrics)
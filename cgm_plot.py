@@ -1,62 +1,146 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib as mpl
+from matplotlib.figure import Figure
+from matplotlib.image import AxesImage
 import numpy as np
 #from datetime import datetime
-from scipy.integrate import trapz, simps
 from scipy.signal import savgol_filter
 #import seaborn as sns
-#import os
+from pathlib import Path
 
-mpl.rcParams['font.family'] = 'Avenir'
-
-# Function to convert time to minutes since midnight
-def time_to_minutes(t):
-    return t.hour * 60 + t.minute
+import cgm_grid as cgmg
+import cgm_ingest as cgmi
+import cgm_matrix as cgmm
 
-# Ingest the CSV into a pandas DataFrame
-#csv_file = """
-#csv_file_basename = os.path.basename(csv_file)
-#csv_file_dirname = os.path.dirname(csv_file)
+# np.trapz was renamed np.trapezoid in NumPy 2
+trapezoid = getattr(np, 'trapezoid', None) or np.trapz
 
-#ptname = os.path.basename(csv_file).split('%')[0].split('_')[2:4]
-#ptname = ','.join(ptname)
+mpl.rcParams['font.family'] = 'Avenir'
 
-def create_cgm_plot(csv_file):
-    df = pd.read_csv(csv_file, parse_dates=[1])
+# Define color gradients based on the hex colors you provided
+night_color = np.array([0, 32, 128]) / 255.
+daytime_color = np.array([255, 223, 186]) / 255.   # A yellow daylight color
+sunrise_middle = np.array([38, 125, 255]) / 255.   # #267DFF
+sunset_middle = np.array([218, 89, 85]) / 255.    # #DA5955
+
+def interpolate_colors(colors, num):
+    """Generate interpolated color values."""
+    r_diff = colors[1, 0] - colors[0, 0]
+    g_diff = colors[1, 1] - colors[0, 1]
+    b_diff = colors[1, 2] - colors[0, 2]
+
+    r = np.linspace(colors[0, 0], colors[0, 0] + r_diff, num)
+    g = np.linspace(colors[0, 1], colors[0, 1] + g_diff, num)
+    b = np.linspace(colors[0, 2], colors[0, 2] + b_diff, num)
+
+    return list(zip(r, g, b))
+
+# Background gradient for each part of the day, in minutes since midnight
+periods = [(300, 370, [night_color, sunrise_middle]),
+        (370, 440, [sunrise_middle, daytime_color]),
+        (440, 1100, [daytime_color, daytime_color]),
+        (1100, 1200, [daytime_color, sunset_middle]),
+        (1200, 1300, [sunset_middle, night_color]),
+        (0, 300, [night_color, night_color]), 
+        (1300, 1440, [night_color, night_color])]
+
+def background_image(periods, alpha=0.40):
+    """Returns the background as a 1 x 1440 RGBA image, one pixel per minute of the day"""
+    image = np.zeros((1, 1440, 4))
+    for start, end, colors in periods:
+        image[0, start:end, :3] = interpolate_colors(np.array(colors), end-start)
+    image[0, :, 3] = alpha
+    return image
+
+# Built once for every plot
+background_rgba = background_image(periods)
+
+def _draw_profile_axes(ax):
+    """Draws what every daily profile has around its curves, once they're on ax: the background of the time of day,
+    the reference glucose lines, hourly ticks, the axis labels and the legend. Callers set the x limits afterwards"""
+    # Shade background using gradient, drawn as a single image spanning the full height of the plot.
+    # Its extent is in axes units vertically, so it's added as a plain artist that doesn't count towards the axis limits
+    background = AxesImage(ax, interpolation='nearest', extent=(0, 1440, 0, 1), transform=ax.get_xaxis_transform(), zorder=0)
+    background.set_data(background_rgba)
+    ax.add_artist(background)
 
-    # Extract the datetime and glucose columns
-    df = df.iloc[:, [1, 7]]
-    df.columns = ["Datetime", "Glucose"]
+    # Add horizontal lines at specific glucose levels
+    ax.axhline(y=90, color='grey', linestyle='--', alpha=0.5)
+    ax.axhline(y=100, color='green', linestyle='-', alpha=0.5)
+    ax.axhline(y=110, color='yellow', linestyle='--', alpha=0.5)
+    ax.axhline(y=140, color='red', linestyle='--', alpha=0.5)
 
-    df = df.dropna(subset=['Datetime'])
+    # Formatting the x-ticks to display time
+    ax.set_xticks(ticks=[i for i in range(0, 24*60+1, 60)],
+            labels=[f'{i:02}:00' for i in range(25)],
+            rotation=45)
 
-    # Find date range
-    min_date = df['Datetime'].min()
-    max_date = df['Datetime'].max()
-    date_range = f"{min_date.strftime('%m/%d/%Y')} to {max_date.strftime('%m/%d/%Y')}"
+    ax.set_xlabel("Time of Day")
+    ax.set_ylabel("Glucose (mg/dL)")
+    ax.legend(loc='upper left', bbox_to_anchor=(0, 1))
 
-    # Convert Glucose to numeric type (in case it's stored as strings)
-    df['Glucose'] = pd.to_numeric(df['Glucose'], errors='coerce')
+# Function to convert time to minutes since midnight
+def time_to_minutes(t):
+    return t.hour * 60 + t.minute
 
-    # Extract just the time component and convert to minutes since midnight
-    df['Minutes'] = df['Datetime'].dt.time.apply(time_to_minutes)
+# Line colors for each period of a comparison, in order
+period_colors = ['#267DFF', '#DA5955', '#2CA02C', '#9467BD', '#FF7F0E', '#17BECF']
+
+def smooth_curve(values, window_size=111, poly_order=2):
+    """Savitzky-Golay smoothing, with the window cut down to fit curves shorter than it"""
+    window_size = min(window_size, len(values) - (len(values) + 1) % 2)
+    if window_size <= poly_order:
+        return np.asarray(values)
+    return savgol_filter(values, window_size, poly_order)
+
+def draw_cgm_comparison(fig, df, periods):
+    """Draws the smoothed median and 34th-68th percentile band of each (start, end) period overlaid on one daily profile,
+    e.g. before and after a change in therapy. All the periods' profiles come from one pass over a period x minute stack"""
+    df = cgmg.gridded(df)
+    step = cgmg.grid_step(df)
+    stack = cgmm.period_stack(df['Datetime'], df['Glucose'], periods)
+    profiles = cgmm.period_profiles(stack, periods)
+    window_size = 111
+    window_points = cgmg.grid_points(window_size, step)
+
+    ax = fig.add_subplot()
+    for period, color in zip(periods, period_colors * (len(periods) // len(period_colors) + 1)):
+        label = cgmm.period_label(period)
+        profile = profiles[label].dropna(how='all')
+        if profile.empty:
+            continue
+        ax.fill_between(profile.index, smooth_curve(profile[0.34], window_points), smooth_curve(profile[0.68], window_points),
+                         color=color, alpha=0.15)
+        ax.plot(profile.index, smooth_curve(profile[0.5], window_points), label=label, color=color, alpha=0.85, linewidth=2)
+
+    _draw_profile_axes(ax)
+    ax.set_xlim(left=0, right=24*60 - 1)
+
+    fig.tight_layout()
+    title = f"CGM Median and 34th-68th Percentile by Period | Smoothed over {window_size} minute windows using Savitzky-Golay Smoothing"
+    ax.set_title(title, weight='bold')
+    fig.subplots_adjust(top=0.90)
+    return fig
+
+def draw_cgm_plot(fig, df):
+    """Draws the smoothed daily profile of the readings on fig: the median, the area where the 68th percentile
+    is above 100 mg/dL and the maximum, over the background of the time of day"""
+    # Find date range
+    date_range = cgm_date_range(df)
 
-    # Removing extreme outliers using IQR method for each minute group
-    def remove_outliers(group):
-        Q1 = group['Glucose'].quantile(0.34)
-        Q3 = group['Glucose'].quantile(0.68)
-        IQR = Q3 - Q1
-        lower_bound = Q1 - 1.5 * IQR
-        upper_bound = Q3 + 1.5 * IQR
-        return group[(group['Glucose'] >= lower_bound) & (group['Glucose'] <= upper_bound)]
+    # Put the readings on a regular grid, so every day fills the same minutes and short dropouts are bridged
+    df = cgmg.gridded(df)
+    step = cgmg.grid_step(df)
 
-    df = df.groupby('Minutes').apply(remove_outliers).reset_index(drop=True)
+    # Lay the readings out as a day x minute-of-day matrix, so every per-minute statistic is one array operation
+    matrix = cgmm.minute_matrix(df['Datetime'], df['Glucose'])
 
+    # Removing extreme outliers using IQR method for each minute of the day
+    matrix = cgmm.remove_outliers(matrix, 0.34, 0.68)
 
-    # Calculate the quantiles for each minute after outlier removal and interpolation
-    grouped = df.groupby('Minutes').Glucose
-    quantiles = grouped.quantile([0.10, 0.34, 0.50, 0.68, 0.90]).unstack()
+    # Calculate the quantiles for each minute after outlier removal
+    quantiles = cgmm.quantile_profile(matrix, [0.10, 0.34, 0.50, 0.68, 0.90])
 
     # Padding the start and end of the quantiles DataFrame
     window_size = 20
@@ -75,55 +159,20 @@ def create_cgm_plot(csv_file):
 
 
     # Applying the Savitzky-Golay filter to smooth the data
-    window_size = 111  # Should be odd
+    window_size = 111  # In minutes
+    window_points = cgmg.grid_points(window_size, step)  # Grid points in the window, always odd
     poly_order = 2  # Polynomial order for the filter
 
     # Applying the filter for each quantile
     smoothed_quantiles = quantiles.copy()
-    minutes_mask = df.groupby('Minutes').size().reindex(range(0, 1440)).notna()
-    quantiles = quantiles[minutes_mask]
 
     for col in smoothed_quantiles.columns:
-        smoothed_quantiles[col] = savgol_filter(quantiles[col], window_size, poly_order)
-
-    # Define color gradients based on the hex colors you provided
-    night_color = np.array([0, 32, 128]) / 255.
-    daytime_color = np.array([255, 223, 186]) / 255.   # A yellow daylight color
-    sunrise_middle = np.array([38, 125, 255]) / 255.   # #267DFF
-    sunset_middle = np.array([218, 89, 85]) / 255.    # #DA5955
-
-    def interpolate_colors(colors, num):
-        """Generate interpolated color values."""
-        r_diff = colors[1, 0] - colors[0, 0]
-        g_diff = colors[1, 1] - colors[0, 1]
-        b_diff = colors[1, 2] - colors[0, 2]
-
-        r = np.linspace(colors[0, 0], colors[0, 0] + r_diff, num)
-        g = np.linspace(colors[0, 1], colors[0, 1] + g_diff, num)
-        b = np.linspace(colors[0, 2], colors[0, 2] + b_diff, num)
-
-        return list(zip(r, g, b))
-
-    plt.figure(figsize=(15, 8))
-    ax = plt.gca()
-
-    # Shade background using gradient
-    periods = [(300, 370, [night_color, sunrise_middle]),
-            (370, 440, [sunrise_middle, daytime_color]),
-            (440, 1100, [daytime_color, daytime_color]),
-            (1100, 1200, [daytime_color, sunset_middle]),
-            (1200, 1300, [sunset_middle, night_color]),
-            (0, 300, [night_color, night_color]), 
-            (1300, 1440, [night_color, night_color])]
-
-    for start, end, colors in periods:
-        gradient = interpolate_colors(np.array(colors), end-start)
-        for i, color in enumerate(gradient):
-            ax.axvspan(start+i, start+i+1, facecolor=color, alpha=0.40)
+        smoothed_quantiles[col] = smooth_curve(quantiles[col], window_points, poly_order)
 
+    ax = fig.add_subplot()
 
     # Plot the median glucose level
-    plt.plot(smoothed_quantiles.index, smoothed_quantiles[0.5], label='Mean', color='#267DFF', alpha=0.75, linewidth=2)
+    ax.plot(smoothed_quantiles.index, smoothed_quantiles[0.5], label='Mean', color='#267DFF', alpha=0.75, linewidth=2)
 
     # Shaded areas for the quantiles
     #plt.fill_between(smoothed_quantiles.index, smoothed_quantiles[0.10], smoothed_quantiles[0.90], color='gray', alpha=0.1, label='10th-90th Percentile')
@@ -133,11 +182,11 @@ def create_cgm_plot(csv_file):
     mask_above_100 = smoothed_quantiles[0.68] > 100
 
     # Use the masked values to calculate the area
-    area_above_100 = np.trapz(smoothed_quantiles[0.68][mask_above_100] - 100, dx=1)
+    area_above_100 = trapezoid(smoothed_quantiles[0.68][mask_above_100] - 100, dx=step)
 
 
     # Shade the area between the 75th percentile curve and the 100 mg/dL line
-    plt.fill_between(smoothed_quantiles.index, 
+    ax.fill_between(smoothed_quantiles.index, 
                     np.where(smoothed_quantiles[0.68] > 100, smoothed_quantiles[0.68], 100), 
                     100, 
                     where=smoothed_quantiles[0.68] > 100, 
@@ -147,61 +196,120 @@ def create_cgm_plot(csv_file):
     #sns.swarmplot(x=df['Minutes'], y=df['Glucose'], color="#FF8C69", size=1.5, alpha=0.25)
 
 
-
-    # Add horizontal lines at specific glucose levels
-    plt.axhline(y=90, color='grey', linestyle='--', alpha=0.5)
-    plt.axhline(y=100, color='green', linestyle='-', alpha=0.5)
-    plt.axhline(y=110, color='yellow', linestyle='--', alpha=0.5)
-    plt.axhline(y=140, color='red', linestyle='--', alpha=0.5)
-
-
-    # Formatting the x-ticks to display time
-    plt.xticks(ticks=[i for i in range(0, 24*60+1, 60)], 
-            labels=[f'{i:02}:00' for i in range(25)], 
-            rotation=45)
-
-    ax.set_xlim(left=smoothed_quantiles.index.min(), right=smoothed_quantiles.index.max())
-
     # Calculate the portions of the 25th and 75th percentile curves that are above 100 mg/dL
     diff_25_above_100 = np.maximum(smoothed_quantiles[0.34].values - 100, 0)
     diff_75_above_100 = np.maximum(smoothed_quantiles[0.68].values - 100, 0)
     #print(diff_25_above_100,diff_75_above_100)
     # Calculate the AUC between the two curves, considering only the portions above 100 mg/dL
-    auc_between_curves = np.trapz(diff_75_above_100 - diff_25_above_100, smoothed_quantiles.index.values)
+    auc_between_curves = trapezoid(diff_75_above_100 - diff_25_above_100, smoothed_quantiles.index.values)
 
     #print(f"This is currently wrong: AUC between 25th and 75th percentile curves above 100 mg/dL: {auc_between_curves:.2f}")
 
     # Plot the line for max values
-    max_values = df.groupby('Minutes').Glucose.max()
-    df_max = df.groupby('Minutes').Glucose.max().reset_index()
-    df_max.columns = ['Minutes', 'Glucose']
-    df_max = df_max.groupby('Minutes').apply(remove_outliers).reset_index(drop=True)
+    df_max = cgmm.max_profile(matrix).reset_index()
     #df_max['Glucose'].interpolate(method='linear', inplace=True)
     # Calculate the number of values you need to pad (half of the window size)
     # Pad the front and end of the dataset with replicated data
     #padded_data = pd.concat([df_max['Glucose'].head(pad_size).iloc[::-1], df_max['Glucose'], df_max['Glucose'].tail(pad_size).iloc[::-1]])
     #smoothed_max_padded = padded_data.rolling(window=20, center=True).max()
 
-    savgol_data = savgol_filter(df_max['Glucose'], window_length=window_size, polyorder=poly_order)
+    savgol_data = smooth_curve(df_max['Glucose'], window_points, poly_order)
     #smoothed_max = smoothed_max_padded.iloc[pad_size:-pad_size].reset_index(drop=True)
-    plt.plot(df_max['Minutes'], savgol_data, label='Smoothed Maximum', color='red', alpha=0.25, linewidth=2, linestyle='--')
+    ax.plot(df_max['Minutes'], savgol_data, label='Smoothed Maximum', color='red', alpha=0.25, linewidth=2, linestyle='--')
 
 
     #plt.title("Smoothed Glucose Readings Quantiles Throughout the Day (Outliers Removed)")
-    plt.xlabel("Time of Day")
-    plt.ylabel("Glucose (mg/dL)")
-    plt.legend(loc='upper left', bbox_to_anchor=(0, 1))
+    _draw_profile_axes(ax)
+    ax.set_xlim(left=smoothed_quantiles.index.min(), right=smoothed_quantiles.index.max())
 
-    plt.tight_layout()
+    fig.tight_layout()
     title=f"{date_range} | CGM Readings | Smoothed over {window_size} minute windows using Savitzky-Golay Smoothing"
-    plt.title(title, weight='bold')
+    ax.set_title(title, weight='bold')
 
-    plt.subplots_adjust(top=0.90)  # Adjust the top spacing to 90% of the figure height
+    fig.subplots_adjust(top=0.90)  # Adjust the top spacing to 90% of the figure height
 
+    #plt.show()
+    return fig
+
+def draw_cgm_heatmaps(fig, df):
+    """Draws every day's readings as a date x time-of-day heatmap above the median for each weekday and hour.
+    Each is a single image of the reshaped minute matrix, however many days there are"""
+    df = cgmg.gridded(df)
+    step = cgmg.grid_step(df)
+    matrix = cgmm.minute_matrix(df['Datetime'], df['Glucose'])
+    days = cgmm.binned_day_values(matrix, step)
+    weekdays = cgmm.weekday_hour_medians(matrix)
+    vmin, vmax = cgmm.heatmap_glucose_range
+
+    day_ax, weekday_ax = fig.subplots(2, 1, gridspec_kw={'height_ratios': [3, 1]})
+
+    image = day_ax.imshow(days, extent=(0, 24*60, len(matrix.days), 0), aspect='auto', interpolation='nearest',
+                          cmap='RdYlBu_r', vmin=vmin, vmax=vmax)
+    # Label about a dozen of the dates, at the middle of their rows
+    date_step = max(len(matrix.days) // 12, 1)
+    day_ax.set_yticks([i + 0.5 for i in range(0, len(matrix.days), date_step)])
+    day_ax.set_yticklabels([day.strftime('%m/%d/%Y') for day in matrix.days[::date_step]])
+    day_ax.set_xticks([i for i in range(0, 24*60+1, 60)])
+    day_ax.set_xticklabels([f'{i:02}:00' for i in range(25)], rotation=45)
+    day_ax.set_xlabel("Time of Day")
+    day_ax.set_title("CGM Readings by Day", weight='bold')
+
+    weekday_ax.imshow(weekdays.to_numpy(), extent=(0, 24, 7, 0), aspect='auto', interpolation='nearest',
+                      cmap='RdYlBu_r', vmin=vmin, vmax=vmax)
+    weekday_ax.set_yticks([i + 0.5 for i in range(7)])
+    weekday_ax.set_yticklabels(weekdays.index)
+    weekday_ax.set_xticks(range(25))
+    weekday_ax.set_xticklabels([f'{i:02}:00' for i in range(25)], rotation=45)
+    weekday_ax.set_xlabel("Hour of Day")
+    weekday_ax.set_title("Median Glucose by Weekday and Hour", weight='bold')
+
+    fig.colorbar(image, ax=[day_ax, weekday_ax], label="Glucose (mg/dL)")
+    return fig
+
+def create_cgm_comparison_plot(df, periods):
+    """Overlays the daily profiles of each (start, end) period on one pyplot figure"""
+    draw_cgm_comparison(plt.figure(figsize=(15, 8)), df, periods)
+    return plt
 
-    dates = date_range.replace(' ','_').replace('/','.')
-    #outfile = f"{csv_file_dirname}/{ptname}_cgm_plot_{dates}.png"
-    #plt.savefig(outfile, dpi=300)
+def create_cgm_plot(csv_file, periods=None):
+    # Read just the datetime and glucose columns, from the Parquet sidecar if this file has been read before.
+    # Readings already loaded, like a window of a patient's stored history, are used as they are
+    df = cgmi.cgm_readings(csv_file)
 
-    #plt.show()
+    # A list of (start, end) dates compares those periods instead of profiling the whole file
+    if periods:
+        return create_cgm_comparison_plot(df, periods)
+
+    draw_cgm_plot(plt.figure(figsize=(15, 8)), df)
+    return plt
+
+def create_cgm_heatmaps(csv_file):
+    """Plots every day's readings as a date x time-of-day heatmap above the median for each weekday and hour"""
+    draw_cgm_heatmaps(plt.figure(figsize=(15, 12), layout='constrained'), cgmi.cgm_readings(csv_file))
     return plt
+
+def cgm_figure(df, periods=None):
+    """The daily profile (or the comparison of periods) as a Figure that pyplot doesn't keep track of,
+    so it's freed once it's saved rather than piling up in pyplot's list of open figures"""
+    fig = Figure(figsize=(15, 8))
+    if periods:
+        return draw_cgm_comparison(fig, df, periods)
+    return draw_cgm_plot(fig, df)
+
+def cgm_heatmaps_figure(df):
+    return draw_cgm_heatmaps(Figure(figsize=(15, 12), layout='constrained'), df)
+
+def cgm_patient_name(csv_file):
+    """The patient's name from the file name of a CGM export, e.g. 'Doe,Jane' from Clarity_Export_Doe_Jane_2024-03-15.csv.
+    Files named any other way give their name without the extension"""
+    ptname = Path(csv_file).stem.split('%')[0].split('_')[2:4]
+    return ','.join(ptname) or Path(csv_file).stem
+
+def cgm_date_range(df):
+    return f"{df['Datetime'].min().strftime('%m/%d/%Y')} to {df['Datetime'].max().strftime('%m/%d/%Y')}"
+
+def cgm_plot_file(csv_file, df, kind='plot', format='png', name=None):
+    """The file name for a figure of a CGM export, e.g. Doe,Jane_cgm_plot_03.01.2024_to_03.14.2024.png.
+    name, if given, is used in place of the patient's name"""
+    dates = cgm_date_range(df).replace(' ','_').replace('/','.')
+    return f"{name or cgm_patient_name(csv_file)}_cgm_{kind}_{dates}.{format}"
@@ -0,0 +1,110 @@
+import numpy as np
+import plotly.graph_objects as go
+
+import cgm_grid as cgmg
+import cgm_matrix as cgmm
+
+
+# Most points sent to the browser per trace
+cgm_point_budget = 2000
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets downsampling: returns the indices of n_out points that keep the shape
+    of the line through x and y (both sorted by x), always including the first and last point"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # The points between the first and last are split into n_out - 2 buckets, each of which gives one point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    bucket_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / np.diff(edges)
+    bucket_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / np.diff(edges)
+    # The last bucket looks ahead to the last point
+    next_x = np.r_[bucket_x[1:], x[n - 1]]
+    next_y = np.r_[bucket_y[1:], y[n - 1]]
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Keep the point making the largest triangle with the last point kept and the average of the next bucket
+        area = np.abs((x[a] - next_x[i]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y[i] - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+def create_cgm_series_fig(df, point_budget=cgm_point_budget):
+    """Returns a WebGL Plotly figure of the readings over time on the regular grid, downsampled to at most point_budget points.
+    The line breaks across gaps in the readings"""
+    df = cgmg.gridded(df)
+    times = df['Datetime'].to_numpy(dtype='datetime64[ns]')
+    glucose = df['Glucose'].to_numpy(dtype=float)
+    gap = df['Gap'].to_numpy()
+
+    # Downsample with the gaps bridged, then put them back wherever a point inside one was kept
+    if gap.any() and not gap.all():
+        glucose[gap] = np.interp(times.view(np.int64)[gap], times.view(np.int64)[~gap], glucose[~gap])
+    keep = lttb(times.view(np.int64), glucose, point_budget)
+    # Always keep the first point of each gap, so the line breaks there even if nothing else inside it was kept
+    gap_starts = np.flatnonzero(gap & ~np.r_[False, gap[:-1]])
+    keep = np.union1d(keep, gap_starts)
+    glucose[gap] = np.nan
+
+    fig = go.Figure()
+    fig.add_hrect(y0=70, y1=180, fillcolor='green', opacity=0.08, line_width=0)
+    fig.add_trace(go.Scattergl(x=times[keep], y=glucose[keep], mode='lines', name='Glucose',
+                               line=dict(color='#267DFF', width=1)))
+    fig.update_layout(title=f'CGM Readings ({len(keep):,} of {len(glucose):,} points shown, {gap.mean():.0%} in gaps)',
+                      xaxis_title='Date', yaxis_title='Glucose (mg/dL)')
+    return fig
+
+def create_cgm_profile_fig(df, point_budget=cgm_point_budget):
+    """Returns a WebGL Plotly figure of the daily profile: the median at each minute of the day,
+    with the 10th-90th and 34th-68th percentile bands"""
+    df = cgmg.gridded(df)
+    profile = cgmm.quantile_profile(cgmm.remove_outliers(cgmm.minute_matrix(df['Datetime'], df['Glucose'])))
+    keep = lttb(profile.index.to_numpy(), profile[0.5].to_numpy(), point_budget)
+    profile = profile.iloc[keep]
+    hours = profile.index / 60
+
+    fig = go.Figure()
+    for low, high, opacity, name in [(0.10, 0.90, 0.15, '10th-90th Percentile'), (0.34, 0.68, 0.30, '34th-68th Percentile')]:
+        fig.add_trace(go.Scattergl(x=hours, y=profile[low], mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'))
+        fig.add_trace(go.Scattergl(x=hours, y=profile[high], mode='lines', line=dict(width=0), fill='tonexty',
+                                   fillcolor=f'rgba(128, 128, 128, {opacity})', name=name))
+    fig.add_trace(go.Scattergl(x=hours, y=profile[0.5], mode='lines', name='Median', line=dict(color='#267DFF', width=2)))
+    fig.update_layout(title='Daily Glucose Profile', xaxis_title='Hour of Day', yaxis_title='Glucose (mg/dL)',
+                      xaxis=dict(tickmode='array', tickvals=list(range(25)), ticktext=[f'{i:02}:00' for i in range(25)]))
+    return fig
+
+def create_cgm_day_heatmap_fig(df):
+    """Returns a Plotly heatmap of every day's readings, dates down and time of day across, as a single trace"""
+    df = cgmg.gridded(df)
+    step = cgmg.grid_step(df)
+    matrix = cgmm.minute_matrix(df['Datetime'], df['Glucose'])
+    vmin, vmax = cgmm.heatmap_glucose_range
+    minutes = np.arange(0, cgmm.minutes_per_day, step)
+
+    fig = go.Figure(go.Heatmap(z=cgmm.binned_day_values(matrix, step), x=minutes / 60, y=matrix.days,
+                               colorscale='RdYlBu', reversescale=True, zmin=vmin, zmax=vmax,
+                               colorbar=dict(title='mg/dL'), hovertemplate='%{y|%m/%d/%Y} %{x:.2f}h: %{z:.0f} mg/dL<extra></extra>'))
+    fig.update_layout(title='CGM Readings by Day', xaxis_title='Hour of Day', yaxis=dict(autorange='reversed'),
+                      xaxis=dict(tickmode='array', tickvals=list(range(25)), ticktext=[f'{i:02}:00' for i in range(25)]))
+    return fig
+
+def create_weekday_heatmap_fig(df):
+    """Returns a Plotly heatmap of the median glucose for each weekday and hour of the day"""
+    df = cgmg.gridded(df)
+    weekdays = cgmm.weekday_hour_medians(cgmm.minute_matrix(df['Datetime'], df['Glucose']))
+    vmin, vmax = cgmm.heatmap_glucose_range
+
+    fig = go.Figure(go.Heatmap(z=weekdays.to_numpy(), x=[f'{i:02}:00' for i in weekdays.columns], y=weekdays.index,
+                               colorscale='RdYlBu', reversescale=True, zmin=vmin, zmax=vmax,
+                               colorbar=dict(title='mg/dL'), hovertemplate='%{y} %{x}: %{z:.0f} mg/dL<extra></extra>'))
+    fig.update_layout(title='Median Glucose by Weekday and Hour', xaxis_title='Hour of Day', yaxis=dict(autorange='reversed'))
+    return fig
@@ -0,0 +1,135 @@
+import csv
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# Bytes and rows looked at to work out an export's layout, which is all detection ever reads
+sample_bytes = 64 * 1024
+sample_rows = 50
+
+# Glucose readings in mmol/L are multiplied by this to give mg/dL
+mmol_to_mgdl = 18.0
+
+
+class CgmSchema:
+    """A known CGM export layout: the row holding the column names, the timestamp column, the glucose
+    columns (the first with a reading is used, e.g. Libre's historic then scan glucose), the timestamp format
+    and the factor that converts its glucose units to mg/dL"""
+
+    def __init__(self, name, header_row, timestamp_column, glucose_columns, format=None, scale=1.0):
+        self.name = name
+        self.header_row = header_row
+        self.timestamp_column = timestamp_column
+        self.glucose_columns = glucose_columns
+        self.format = format
+        self.scale = scale
+
+    def match(self, header):
+        """Returns the layout of this schema for a header row, or None if the columns aren't there"""
+        if self.timestamp_column not in header:
+            return None
+        glucose_columns = [header.index(column) for column in self.glucose_columns if column in header]
+        if not glucose_columns:
+            return None
+        return make_layout(self.name, self.header_row, header.index(self.timestamp_column), glucose_columns, self.format, self.scale)
+
+
+# Known layouts, checked in order
+schema_registry = [
+    CgmSchema('Dexcom Clarity', 0, 'Timestamp (YYYY-MM-DDThh:mm:ss)', ['Glucose Value (mg/dL)'], '%Y-%m-%dT%H:%M:%S'),
+    CgmSchema('Dexcom Clarity (mmol/L)', 0, 'Timestamp (YYYY-MM-DDThh:mm:ss)', ['Glucose Value (mmol/L)'], '%Y-%m-%dT%H:%M:%S', mmol_to_mgdl),
+    # LibreView puts a title row above the column names
+    CgmSchema('Libre', 1, 'Device Timestamp', ['Historic Glucose mg/dL', 'Scan Glucose mg/dL'], '%m-%d-%Y %I:%M %p'),
+    CgmSchema('Libre (mmol/L)', 1, 'Device Timestamp', ['Historic Glucose mmol/L', 'Scan Glucose mmol/L'], '%m-%d-%Y %I:%M %p', mmol_to_mgdl),
+]
+
+# Column names a generic export is likely to use
+generic_timestamp_pattern = re.compile(r'time|date', re.IGNORECASE)
+generic_glucose_pattern = re.compile(r'glucose|\bsg\b|\bbg\b|sensor', re.IGNORECASE)
+
+# The lowest row any known layout has its column names on
+max_header_row = max([schema.header_row for schema in schema_registry])
+
+# Resolved layouts by (header row, column names), so each kind of export is only matched once per process
+layout_cache = {}
+
+
+def make_layout(name, header_row, timestamp_column, glucose_columns, format=None, scale=1.0):
+    """A resolved layout, with the timestamp and glucose columns as positions in the header row"""
+    return {
+        'name': name,
+        'header_row': header_row,
+        'timestamp_column': timestamp_column,
+        'glucose_columns': list(glucose_columns),
+        'format': format,
+        'scale': scale,
+    }
+
+def sample_lines(data):
+    """The first rows of the export, parsed as CSV"""
+    text = data[:sample_bytes].decode('utf-8-sig', errors='replace')
+    lines = text.splitlines()
+    # The last line may have been cut off part way through
+    if len(data) > sample_bytes:
+        lines = lines[:-1]
+    return list(csv.reader(lines[:max_header_row + 1 + sample_rows]))
+
+def sniff_layout(header, rows, header_row):
+    """Works out the timestamp and glucose columns from the column names if they look like a generic export,
+    otherwise from the values in the rows below the header: the timestamp column is the one whose values
+    most often parse as dates, and the glucose column the one most often holding plausible mg/dL readings.
+    Returns None if there's no such pair"""
+    columns = pd.DataFrame([row[:len(header)] + [''] * (len(header) - len(row)) for row in rows], columns=range(len(header)), dtype=object)
+    columns = columns.replace('', np.nan)
+    if columns.empty:
+        return None
+
+    timestamp_columns = [i for i, name in enumerate(header) if generic_timestamp_pattern.search(name)]
+    glucose_columns = [i for i, name in enumerate(header) if generic_glucose_pattern.search(name)]
+
+    # The fraction of each column's values that parse as dates, and as numbers in a plausible range
+    dated = {}
+    plausible = {}
+    for i in columns.columns:
+        values = columns[i].dropna().astype(str)
+        if values.empty:
+            continue
+        numbers = pd.to_numeric(values, errors='coerce')
+        # Row numbers count up, so they can't be glucose readings
+        counting = numbers.notna().all() and len(numbers) > 1 and (numbers.diff().dropna() > 0).all()
+        if not counting:
+            plausible[i] = numbers.between(20, 600).mean()
+        if numbers.isna().all():
+            dated[i] = pd.to_datetime(values, format='mixed', errors='coerce').notna().mean()
+
+    timestamp_columns = [i for i in timestamp_columns if dated.get(i, 0) > 0.5] or \
+        sorted([i for i in dated if dated[i] > 0.5], key=lambda i: -dated[i])
+    glucose_columns = [i for i in glucose_columns if plausible.get(i, 0) > 0] or \
+        sorted([i for i in plausible if plausible[i] > 0.5], key=lambda i: -plausible[i])
+    if not timestamp_columns or not glucose_columns:
+        return None
+    return make_layout('Generic', header_row, timestamp_columns[0], glucose_columns[:1])
+
+def detect_layout(data):
+    """Accepts the bytes of a CGM export and returns its layout, matching its first rows against schema_registry
+    and falling back to sniffing the columns' contents. Raises ValueError if no timestamp and glucose columns can be found"""
+    lines = sample_lines(data)
+    for header_row, header in enumerate(lines[:max_header_row + 1]):
+        signature = (header_row, tuple(header))
+        if signature in layout_cache:
+            return layout_cache[signature]
+        for schema in schema_registry:
+            if schema.header_row == header_row:
+                layout = schema.match(header)
+                if layout is not None:
+                    layout_cache[signature] = layout
+                    return layout
+
+    for header_row, header in enumerate(lines[:max_header_row + 1]):
+        layout = sniff_layout(header, lines[header_row + 1:], header_row)
+        if layout is not None:
+            layout_cache[(header_row, tuple(header))] = layout
+            return layout
+    raise ValueError('Could not find the timestamp and glucose columns in the CGM export')
@@ -0,0 +1,173 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import results_cache as rcache
+
+
+# One folder per patient, kept with the results cache unless TRENDS_CGM_STORE says otherwise
+cgm_store_dir = os.environ.get('TRENDS_CGM_STORE', os.path.join(rcache.results_cache_dir, 'cgm'))
+
+# Named windows of history, as the number of days back from the latest reading. None is everything
+history_windows = {
+    'Last 14 Days': 14,
+    'Last 30 Days': 30,
+    'Last 90 Days': 90,
+    'This Quarter': 'quarter',
+    'All History': None,
+}
+
+
+def patient_dir(patient, store_dir=None):
+    """Each patient's arrays live in a folder named after them, with anything unsafe in a file name replaced"""
+    name = re.sub(r'[^\w\- ,.]', '_', patient.strip()).strip('. ') or '_'
+    return os.path.join(store_dir or cgm_store_dir, name)
+
+def history_file(patient, store_dir=None):
+    """The patient's history file, recording how many readings the arrays hold"""
+    return os.path.join(patient_dir(patient, store_dir), 'history.json')
+
+def history_paths(patient, store_dir=None):
+    """The patient's raw timestamp (int64) and glucose (int16) arrays"""
+    directory = patient_dir(patient, store_dir)
+    return os.path.join(directory, 'timestamps.i64'), os.path.join(directory, 'glucose.i16')
+
+def tail_file(patient, store_dir=None):
+    """Holds a rewritten end of the arrays until it has been copied over them"""
+    return os.path.join(patient_dir(patient, store_dir), 'tail.npz')
+
+def read_history_file(patient, store_dir=None):
+    try:
+        with open(history_file(patient, store_dir)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'length': 0}
+
+def write_history_file(patient, length, store_dir=None):
+    # Written to the side and swapped in, so it's never seen half written
+    path = history_file(patient, store_dir)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump({'length': int(length)}, f)
+    os.replace(f'{path}.tmp', path)
+
+def memmap(path, dtype, length, mode='r', start=0):
+    if not length - start:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, offset=start * np.dtype(dtype).itemsize, shape=(length - start,))
+
+def open_history(patient, store_dir=None):
+    """Returns a patient's readings as read-only memory maps: sorted, unique nanosecond timestamps (int64)
+    and glucose in mg/dL (int16). Both are empty if nothing has been stored for them.
+    Raises ValueError if the arrays are shorter than the history file records"""
+    finish_tail(patient, store_dir)
+    length = read_history_file(patient, store_dir)['length']
+    timestamps_path, glucose_path = history_paths(patient, store_dir)
+    for path, dtype in ((timestamps_path, np.int64), (glucose_path, np.int16)):
+        found = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+        if found < length:
+            raise ValueError(f"The CGM history of {patient} is damaged: expected {length} readings, "
+                             f"found {found} in {os.path.basename(path)}")
+    return memmap(timestamps_path, np.int64, length), memmap(glucose_path, np.int16, length)
+
+def write_tail(patient, start, times, glucose, store_dir=None):
+    """Writes the arrays from index start onwards, growing the files in place, then records the new length.
+    Anything past the recorded length is ignored, so an append cut short leaves the history as it was"""
+    length = start + len(times)
+    timestamps_path, glucose_path = history_paths(patient, store_dir)
+    for path, values in ((timestamps_path, times), (glucose_path, glucose)):
+        # Never truncated, as that would pull pages out from under open memory maps
+        with open(path, 'ab'):
+            pass
+        with open(path, 'r+b') as f:
+            f.seek(start * values.itemsize)
+            f.write(values.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+    write_history_file(patient, length, store_dir)
+
+def finish_tail(patient, store_dir=None):
+    """Copies a rewritten end of the arrays, saved before an append that reached back into the history,
+    over the arrays. Does nothing if there isn't one"""
+    path = tail_file(patient, store_dir)
+    try:
+        with np.load(path) as tail:
+            start, times, glucose = int(tail['start']), tail['times'], tail['glucose']
+    except FileNotFoundError:
+        return
+    write_tail(patient, start, times, glucose, store_dir)
+    os.remove(path)
+
+def append_readings(patient, df, store_dir=None):
+    """Adds CGM readings ('Datetime' and 'Glucose' columns) to a patient's history. Readings at a time already in
+    the history are dropped, so overlapping exports can be added as they come. Readings without a numeric glucose
+    are left out. Returns the number of readings added.
+
+    Readings newer than the whole history, the usual case, are written onto the end of the files. Older ones
+    re-sort only the history from the earliest of them on. That end is saved in full before it is copied over
+    the arrays, so a write cut short is finished the next time the history is opened. Open memory maps see
+    the rewritten end, but never beyond the length they were opened with"""
+    readings = df.dropna(subset=['Datetime', 'Glucose'])
+    new_times = readings['Datetime'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    new_glucose = np.clip(np.round(readings['Glucose'].to_numpy(dtype=float)), -2**15, 2**15 - 1).astype(np.int16)
+    new_times, first = np.unique(new_times, return_index=True)
+    new_glucose = new_glucose[first]
+
+    times, glucose = open_history(patient, store_dir)
+    # Binary search for the new readings the history already has
+    position = np.searchsorted(times, new_times)
+    known = np.zeros(len(new_times), dtype=bool)
+    in_range = position < len(times)
+    known[in_range] = times[position[in_range]] == new_times[in_range]
+    new_times, new_glucose, position = new_times[~known], new_glucose[~known], position[~known]
+    if not len(new_times):
+        return 0
+
+    os.makedirs(patient_dir(patient, store_dir), exist_ok=True)
+    start = position[0]
+    if start == len(times):
+        write_tail(patient, start, new_times, new_glucose, store_dir)
+    else:
+        tail_times = np.insert(np.array(times[start:]), position - start, new_times)
+        tail_glucose = np.insert(np.array(glucose[start:]), position - start, new_glucose)
+        path = tail_file(patient, store_dir)
+        with open(f'{path}.tmp', 'wb') as f:
+            np.savez(f, start=start, times=tail_times, glucose=tail_glucose)
+        os.replace(f'{path}.tmp', path)
+        finish_tail(patient, store_dir)
+    return len(new_times)
+
+def read_window(patient, start=None, end=None, store_dir=None):
+    """Returns a patient's readings from start up to but not including end (either may be None for no limit)
+    as 'Datetime' and 'Glucose' columns, found by binary search so only the window is read from disk"""
+    times, glucose = open_history(patient, store_dir)
+    first = 0 if start is None else np.searchsorted(times, pd.Timestamp(start).value)
+    last = len(times) if end is None else np.searchsorted(times, pd.Timestamp(end).value)
+    return pd.DataFrame({
+        'Datetime': pd.to_datetime(np.array(times[first:last])),
+        'Glucose': np.array(glucose[first:last], dtype=float),
+    })
+
+def window_start(window, latest):
+    """The start of one of history_windows, counting back from the latest reading"""
+    days = history_windows[window]
+    if days is None:
+        return None
+    if days == 'quarter':
+        return pd.Timestamp(latest).to_period('Q').start_time
+    return pd.Timestamp(latest).normalize() - pd.Timedelta(days=days - 1)
+
+def read_named_window(patient, window, store_dir=None):
+    """Returns the readings in one of history_windows, e.g. read_named_window(patient, 'Last 14 Days')"""
+    times, _ = open_history(patient, store_dir)
+    if not len(times):
+        return read_window(patient, store_dir=store_dir)
+    return read_window(patient, window_start(window, pd.Timestamp(int(times[-1]))), store_dir=store_dir)
+
+def stored_patients(store_dir=None):
+    store_dir = store_dir or cgm_store_dir
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted([name for name in os.listdir(store_dir) if os.path.exists(os.path.join(store_dir, name, 'history.json'))])
@@ -8,6 +8,15 @@ import re
 import markdown as markdownmod
 from datetime import datetime
 import os
+from contextlib import closing
+from functools import lru_cache
+
+import trends_dataframe_functions as tdf
+import range_catalog as rc
+import lab_test_names as ltn
+import results_cache as rcache
+import trends_cache as tc
+import results_store as rstore
 
 def is_date(string):
     try: 
@@ -48,17 +57,8 @@ def read_csv_with_mixed_header(filepath):
     # Remove leading and trailing whitespace around strings in the dataframe
     df = df.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
 
-    # Remove test names that also include units -- like lp(a) mg/dl
-    df['test'] = df['test'].apply(replace_lpa)
-
-    # Fix ApoE test name
-    df['test'] = df['test'].apply(replace_apoe)
-
-    # Fix egfr field
-    df['test'] = df['test'].apply(replace_egfr)
-
-    # Fix prostate velocity field
-    df['test'] = df['test'].apply(replace_psa_velocity)
+    # Rename tests to their canonical names -- like lp(a) mg/dl to Lp(a)
+    df['test'] = ltn.canonicalize_test_names(df['test'])
 
     # Make the whole damn dataframe lowercase
     #df = df.applymap(lambda s: s.lower() if type(s) == str else s)
@@ -67,36 +67,9 @@ def read_csv_with_mixed_header(filepath):
 
     return df
 
-def replace_lpa(s):
-    if isinstance(s, str):
-        if re.search(r'lp\(a\)', s, re.IGNORECASE):
-            return 'Lp(a)'
-    return s
-
-def replace_apoe(s):
-    if isinstance(s, str):
-        if re.search(r'apoe', s, re.IGNORECASE):
-            return 'ApoE'
-    return s
-
-def replace_egfr(s):
-    if isinstance(s, str):
-        if re.search(r'egfr', s, re.IGNORECASE):
-            return 'egfr'
-    return s
-
 def re_replace_egfrs_with_cystatincegfr(s):
-    if isinstance(s,str):
-        if re.search(r'egfr',s,re.IGNORECASE):
-            return 'eGFR by Cystatin-C'
-    return s
-
-def replace_psa_velocity(s):
-    if isinstance(s,str):
-        if re.search(r'psa velocity',s,re.IGNORECASE):
-            return 'psa velocity'
-    return s
-    
+    return ltn.display_test_name(s)
+
 def dump_test_and_range(df, filename):
     # Select 'test' and 'range' columns
     selected_df = df[['test', 'range']]
@@ -109,44 +82,11 @@ def dump_test_and_range(df, filename):
 
 
 def split_by_category(df):
-    dataframes = []
-    current_df = pd.DataFrame(columns=df.columns)
-    current_category = None
-
-    for i, row in df.iterrows():
-        # Check if the row is a category row
-        # The 'test' column is one of the specified categories
-        if str(row['test']).lower() in categories:
-            # If we were already building a DataFrame, append it to the list
-            if current_category is not None:
-                dataframes.append((current_category, current_df))
-
-            # Start a new DataFrame for the new category
-            current_category = row['test']
-            current_df = pd.DataFrame(columns=df.columns)
-        else:
-            # If the row is not a category row, append it to the current DataFrame
-            current_df = pd.concat([current_df, pd.DataFrame(row).T])
-
-    # Append the last DataFrame to the list, if it is not empty
-    if not current_df.empty:
-        dataframes.append((current_category, current_df))
-
-    return dataframes
+    return tdf.split_by_category(df, categories)
 
 
 def add_category_column(df):
-    current_category = None
-
-    # Add a new 'category' column to the DataFrame
-    df['category'] = ''
-
-    for i, row in df.iterrows():
-        # Check if the row is a category row
-        if str(row['test']).lower() in categories:
-            current_category = row['test']
-        df.loc[i, 'category'] = current_category
-    return df
+    return tdf.add_category_column(df, categories)
 
 def melt_dataframe(df):
     # Define the columns that should stay the same
@@ -163,43 +103,41 @@ def melt_dataframe(df):
 
     return melted_df
 
-def check_range(result, range_str):
-    # If result is a string containing %, skip the row
-    if isinstance(result, str) and '%' in result:
-        return None
-    
-    # Try to convert result to float, if not possible, skip the row
-    try:
-        result_float = float(result)
-    except ValueError:  # If conversion is not possible, return None and skip the row
-        return None
-    
-    # Ensure range_str is a string for the following checks
-    range_str = str(range_str)
-
-    # Handling range specifications
-    if range_str.startswith('<'):
-        try:
-            upper_limit = float(range_str[1:])
-        except:
-            return None
-        if result_float >= upper_limit:
-            return 'H'
-    elif range_str.startswith('>'):
-        try:
-            lower_limit = float(range_str[1:])
-            if result_float <= lower_limit:
-                return 'L'
-        except:
-            return None
-    elif '-' in range_str:
-        lower_limit, upper_limit = map(float, range_str.split('-'))
-        if result_float < lower_limit:
-            return 'L'
-        elif result_float > upper_limit:
-            return 'H'
-    
-    return None  # If result is within range or range format is unrecognized
+def flag_results(results, limits):
+    """Accepts a Series of results and a DataFrame of limits from parse_range_limits aligned with it
+    and returns a Series with 'H' for results above range, 'L' for results below range and None otherwise.
+    Results that aren't numbers (including percentages) are never flagged"""
+    value = pd.to_numeric(results, errors='coerce').to_numpy(dtype=float)
+    lower = limits['lower'].to_numpy(dtype=float)
+    upper = limits['upper'].to_numpy(dtype=float)
+    kind = limits['kind'].to_numpy()
+
+    high = ((kind == '<') & (value >= upper)) | ((kind == '-') & (value > upper))
+    low = ((kind == '>') & (value <= lower)) | ((kind == '-') & (value < lower))
+    return pd.Series(np.select([high, low], ['H', 'L'], default=None), index=results.index)
+
+def round_exact(values, decimals=1):
+    """Rounds a float array like Python's round(), which np.round doesn't always match
+    for values that sit right on a half (e.g. 33.45), so those few are rounded one by one"""
+    values = np.asarray(values, dtype=float)
+    rounded = np.round(values, decimals)
+    scaled = values * 10**decimals
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    rounded[near_half] = [round(float(value), decimals) for value in values[near_half]]
+    return rounded
+
+def round_floats(df, decimals=1):
+    """Rounds every value in the dataframe that can be read as a number, leaving everything else as it was"""
+    df = df.copy()
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values):
+            df[col] = round_exact(values, decimals)
+        elif pd.api.types.is_object_dtype(values):
+            numbers = pd.to_numeric(values, errors='coerce')
+            rounded = pd.Series(round_exact(numbers, decimals), index=values.index, dtype=object)
+            df[col] = rounded.where(numbers.notna(), values)
+    return df
 
 
 def categorize_single_result_tests(df, test_names):
@@ -214,39 +152,6 @@ def categorize_single_result_tests(df, test_names):
 
     return df
 
-def recategorize(row, category_dict):
-    # Lookup the test name in the category_dict, return the original category if not found
-    return category_dict.get(row['merge_key'], row['category'])
-
-# Define your dictionary here. This should include all test-category pairs.
-category_dict = {
-    'psa': 'prostate',
-    'hb': 'hematology',
-    'ferritin': 'hematology',
-    'iron':'hematology',
-    'egfr - cystatin c': 'renal',
-    'egfr':'renal',
-    'cystatin c':'renal',
-    'urinalysis':'renal',
-    'tsh':'thyroid',
-    'ft4':'thyroid',
-    'ft3':'thyroid',
-    'homocysteine':'metabolic',
-    'hscrp':'metabolic',
-    'uric acid':'metabolic',
-    'homocysteine':'metabolic',
-    'vitamin b12':'vitamins',
-    'vitamin d':'vitamins',
-    'folate':'vitamins',
-    'mthfr':'genetics',
-    'egfr by cystatin-c':'renal',
-    'eGFR by Cystatin-C':'renal',
-    'omega-3':'fatty acids',
-    'psa velocity':'prostate',
-    'lp(a)':'lipoproteins',
-    # Add more tests and their new categories as necessary.
-}
-
 pattern = r'\|(-+\|)+'
 def format_table(match):
     groups = match.group().split('|')[1:-1]
@@ -280,11 +185,12 @@ def sort_dataframe_by_list(df, column, order_list):
     return df_sorted
 
 def dump_to_markdown(df, filename,ranges):
+    """Writes a markdown table per category, where ranges is the RangeCatalog to take reference ranges from"""
     with open(filename, 'w') as f:
         for category in categories:
             
             # Filter the DataFrame by the category
-            category_df = df[df['category'].str.lower() == category.lower()]
+            category_df = df[ltn.matches_test(df['category'], category)]
 
             # Bold any results that are flagged H or L in flag column
             #category_df['result'] = category_df.apply(lambda row: f"=={row['result']}==" if row['flag'] in ['H', 'L'] else row['result'], axis=1)
@@ -326,11 +232,13 @@ def dump_to_markdown(df, filename,ranges):
             #date_columns = date_columns[:3]
             category_df = category_df[non_date_columns + date_columns]  # Reorder columns
 
-            ranges = pd.read_csv(ideal_lab_ranges_file)
-            category_df['merge_key'] = category_df['Test'].str.lower()
+            # Look up the ranges for the tests that have one
+            category_df['merge_key'] = ltn.normalize_test_names(category_df['Test'])
+            has_range = ranges.contains(category_df['merge_key'])
+            category_df = category_df[has_range]
+            category_df = pd.concat([category_df, ranges.lookup(category_df['merge_key']).drop(columns=rc.limit_columns)], axis=1).reset_index(drop=True)
 
-            category_df = category_df.merge(ranges, left_on='merge_key', right_on='test', how='inner')
-            category_df['Test'] = category_df['Test'].apply(re_replace_egfrs_with_cystatincegfr)
+            category_df['Test'] = ltn.map_unique(category_df['Test'], ltn.display_test_name)
             if category_df.empty:                
                 continue
 
@@ -374,136 +282,210 @@ def dump_to_markdown(df, filename,ranges):
             #concatdf.concat(category_df)
 
 prep_template_file_path = "/Volumes/asha_crep/templates/lab_prep_email_old_template.md"
-def write_lab_prep_doc(df,prep_template_file_path,output_dir,suffix):
-    dfc = df.copy()
-    # Equivalent test names mapping
-    equivalent_tests = {
-        'hba1c': ['hga1c', 'hba1c', 'a1c'],
-        'hgb': ['hgb', 'hemoglobin', 'hb'],
-        'vitamin d':['vitd','vitamin d'],
-        'tbili':['tbili','total bilirubin'],
-        'e2': ['e2','estradiol'],
-        'free t': ['free t', 'free testosterone'],
-        'testosterone': ['testosterone','total testosterone', 'total t'],
-        'psa':['PSA','psa'],
-        'hscrp':['hscrp','hs-crp']
-    }
-
-    def expand_equivalents(mapping):
-        expanded = {}
-        
-        for key, values in mapping.items():
-            for value in values:
-                expanded[value] = values
-        return expanded
-
-    expanded_equivalents = expand_equivalents(equivalent_tests)
-    
-    def replacer(match):
-        return match.group(0) + ' ' + str(recent_value) # ) + str(f' ({recent_date})')
-
-    dfc['test'] = dfc['test'].str.lower()
+patient_note_template_path = '/Volumes/asha_crep/templates/patient_note_template_2.md'
+
+# The front matter of a prep template, between the first pair of --- lines
+front_matter_pattern = re.compile(r'^---(.*?)(?![|:])---', re.DOTALL)
+
+# Templates already read and indexed, by path
+template_slots = {}
+
+@lru_cache(maxsize=None)
+def slot_pattern(test_name):
+    """Matches the name of a front matter slot (everything on its line up to the colon) that ends in test_name,
+    treating spaces and underscores as equivalent"""
+    pattern_string = test_name.replace(' ', '[ _]')
+    return re.compile(f'{pattern_string}:$', re.IGNORECASE)
+
+def latest_results(df):
+    """Returns the most recent row for each test in a melted results frame, with the test names lowercased
+    and the dates parsed, in the order the tests first appear"""
+    dfc = df[['test', 'result', 'date']].reset_index(drop=True)
+    dfc['test'] = ltn.normalize_test_names(dfc['test'])
     dfc['date'] = pd.to_datetime(dfc['date'], format='mixed', errors='coerce')
-
-
-    with open(prep_template_file_path,'r') as file:
-        document= file.read()
-    # Extract the header from the document
-    import re
-    header_pattern = re.compile(r'^---(.*?)(?![|:])---', re.DOTALL)
-
-    match = header_pattern.search(document)
+    dfc = dfc[dfc['date'].notna()]
+    return dfc.loc[dfc.groupby('test', sort=False)['date'].idxmax()].reset_index(drop=True)
+
+def parse_template(path):
+    """Reads a prep template and indexes the slots in its front matter. Returns the document, the front matter
+    split at each colon, and the name of the slot that ends at each colon (or None for both if there's no front matter).
+    Each template is only read again if it changes"""
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = template_slots.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    with open(path, 'r') as file:
+        document = file.read()
+    match = front_matter_pattern.search(document)
     if match:
         header = match.group(1)
-        # Loop through unique test names
-        for test in dfc['test'].unique():
-            # Get the most recent value for that test
-            most_recent_row = dfc[dfc['test'] == test].sort_values(by='date', ascending=False).iloc[0]
-            recent_value = most_recent_row['result']
-            recent_date = most_recent_row['date'].strftime("%Y%m%d")
-            todays_date = datetime.now().strftime("%Y%m%d")
-            if 'a1c' in test:
-                print(type(recent_value))
+        colons = [m.start() for m in re.finditer(':', header)]
+        pieces = header.split(':')
+        slots = [header[header.rfind('\n', 0, colon) + 1:colon] for colon in colons]
+        template = (document, pieces, slots)
+    else:
+        template = (document, None, None)
+    template_slots[path] = (stamp, template)
+    return template
+
+def fill_template(template, latest):
+    """Returns the template document with each test's latest result written after every front matter slot
+    named for the test (or one of its equivalent names). A slot that several tests fill gets the later test's value first"""
+    document, pieces, slots = template
+    if pieces is None:
+        return document
+    pieces = list(pieces)
+    slots = list(slots)
+    values = [[] for _ in slots]
+
+    for test, recent_value in zip(latest['test'], latest['result']):
+        if 'a1c' in test:
+            # Add the estimated average glucose as a new slot at the end of the front matter
+            try:
                 eag = int((float(recent_value)*28.7) - 46.7)
-                header += f'eag:{eag}\n'
-            
-            # If the test has equivalent names, loop through each one
-            for equivalent_test in expanded_equivalents.get(test, [test]):
-                # Create a pattern that matches test names, treating spaces and underscores as equivalent
-                pattern_string = equivalent_test.replace(' ', '[ _]')
-                pattern = re.compile(f'{pattern_string}:', re.IGNORECASE)
-                # Replace in the header using re.sub
-                if pattern.search(header):
-                    header = re.sub(pattern, replacer, header)
-        
-        # Replace the original header with the modified header in the document
-        document = re.sub(header_pattern, f'---{header}---', document)
-    file.close()
-    output = os.path.join(output_dir,f'{recent_date}_{suffix}.md')
-    with open(output, 'w') as file:
-        file.write(document)
-
-def main(filename):
-    filename = convert_xlsx_to_csv(filename)
-    ptname = os.path.basename(filename).split('_',1)[0].replace(', ','_')
-    print(ptname)
-    outputdir = Path(filename).parent
-    output_file = os.path.join(outputdir, f'{ptname}_lab_trends')
-    final_dir = os.path.basename(outputdir)
-    markdown_file = f"{output_file}.md"
-    csv_file = f"{output_file}.csv"
-
+            except ValueError:
+                pass
+            else:
+                pieces[-1] += 'eag'
+                slots.append(pieces[-1][pieces[-1].rfind('\n') + 1:])
+                pieces.append(f'{eag}\n')
+                values.append([])
+
+        # If the test has equivalent names, fill the slots for each one
+        for equivalent_test in ltn.expanded_equivalents.get(test, [test]):
+            pattern = slot_pattern(equivalent_test)
+            for slot, slot_values in zip(slots, values):
+                if pattern.search(f'{slot}:'):
+                    slot_values.append(str(recent_value))
+
+    header = pieces[0] + ''.join(':' + ''.join(' ' + value for value in reversed(slot_values)) + piece
+                                 for slot_values, piece in zip(values, pieces[1:]))
+
+    # Replace the original header with the modified header in the document
+    return re.sub(front_matter_pattern, f'---{header}---', document)
+
+def write_lab_prep_docs(df,templates,output_dir,patient=None):
+    """Fills in each of the (template path, suffix) pairs in templates from the latest result for each test in df,
+    which is only worked out once. The files are named for the patient, when given, and the latest draw date.
+    Returns the paths written"""
+    latest = latest_results(df)
+    recent_date = latest['date'].iloc[-1].strftime("%Y%m%d")
+    # Two patients drawn on the same day would otherwise get the same file names
+    prefix = f'{patient}_{recent_date}' if patient else recent_date
+
+    outputs = []
+    for template_path, suffix in templates:
+        document = fill_template(parse_template(template_path), latest)
+        output = os.path.join(output_dir,f'{prefix}_{suffix}.md')
+        with open(output, 'w') as file:
+            file.write(document)
+        outputs.append(output)
+    return outputs
+
+def write_lab_prep_doc(df,prep_template_file_path,output_dir,suffix,patient=None):
+    return write_lab_prep_docs(df,[(prep_template_file_path,suffix)],output_dir,patient)[0]
+
+def melt_workbook(path):
+    """Reads a lab trends workbook into the long format of melt_dataframe, one row per test per date"""
+    filename = convert_xlsx_to_csv(path)
     orig_df = read_csv_with_mixed_header(filename)
 
-    ideal_lab_ranges_file = '/Volumes/asha_crep/programming/ideal_lab_ranges_labcorp.csv'
     #dump_test_and_range(orig_df,test_and_range_csv)
 
     df = add_category_column(orig_df)
     
     # Remove the range column
     df.drop([col for col in df.columns if 'range'.lower() in col.lower()], axis=1, inplace=True)
-    df = df[~df['test'].str.lower().isin(categories)]
+    df = df[~ltn.normalize_test_names(df['test']).isin(categories)]
     df = df.fillna('')
 
-    global melted_df
     melted_df = melt_dataframe(df)
     
     
     melted_df['category'] = melted_df['category'].replace({'Other':'additional biomarkers'})
+    return melted_df
 
-    write_lab_prep_doc(melted_df,prep_template_file_path,outputdir,'prep_email_draft')
-    patient_note_template_path='/Volumes/asha_crep/templates/patient_note_template_2.md'
-    write_lab_prep_doc(melted_df,patient_note_template_path,outputdir,'patient_note_draft')
+def ranges_file_hash():
+    try:
+        return tc.content_hash(tc.read_file_bytes(ideal_lab_ranges_file))
+    except OSError:
+        return None
+
+def load_melted_results(path):
+    """Returns the melted results of a workbook with a 'flag' column added, from the results cache
+    when this exact workbook has been read before with the same ranges file"""
+    ranges = rc.get_range_catalog(ideal_lab_ranges_file)
+    ranges_hash = ranges_file_hash()
+
+    def build(path):
+        results = melt_workbook(path)
+        results['flag'] = flag_results(results['result'], ranges.lookup(results['test']))
+        results.attrs['ranges_hash'] = ranges_hash
+        return results
+
+    # The flags depend on the ranges file as well as the workbook, so both are part of the cache key
+    results = rcache.cached_results(path, 'melted', build, [ranges_hash])
+
+    # Dates as convert_xlsx_to_csv writes them in the CSV headers
+    results['date'] = results['date'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return results
+
+def write_lab_prep_doc_from_store(patient,prep_template_file_path,output_dir,suffix):
+    """Like write_lab_prep_doc, but takes the patient's latest results from the results store instead of a workbook"""
+    with closing(rstore.connect()) as conn:
+        latest = rstore.patient_latest(conn, patient)
+    return write_lab_prep_doc(latest,prep_template_file_path,output_dir,suffix,patient)
+
+def main(filename):
+    results_source = filename
+    results = load_melted_results(filename)
+    filename = converted_csv_name(filename)
+    ptname = os.path.basename(filename).split('_',1)[0].replace(', ','_')
+    print(ptname)
+    outputdir = Path(filename).parent
+    output_file = os.path.join(outputdir, f'{ptname}_lab_trends')
+    final_dir = os.path.basename(outputdir)
+    markdown_file = f"{output_file}.md"
+    csv_file = f"{output_file}.csv"
+
+    # Keep the store of every patient's results up to date with this sheet, unless it's the sheet last imported.
+    # The flags come from the ranges file, so a change to it means importing again too
+    results_hash = f"{tc.content_hash(tc.read_file_bytes(results_source))}:{results.attrs.get('ranges_hash')}"
+    with closing(rstore.connect()) as conn:
+        if rstore.source_hash(conn, ptname) != results_hash:
+            rstore.import_results(conn, ptname, results, results_hash)
+
+    global melted_df
+    melted_df = results.drop(columns=['flag'])
+
+    prep_email_file, patient_note_file = write_lab_prep_docs(melted_df, [
+        (prep_template_file_path, 'prep_email_draft'),
+        (patient_note_template_path, 'patient_note_draft'),
+    ], outputdir, ptname)
 
     df2 = categorize_single_result_tests(melted_df, ['lp\(a\)','apoe'])
     df3 = df2.replace(r'^\s*$', np.nan, regex=True).dropna(how='any')
-    ranges = pd.read_csv(ideal_lab_ranges_file)
-    df3['merge_key'] = df3['test'].str.lower()
+    ranges = rc.get_range_catalog(ideal_lab_ranges_file)
+    df3['merge_key'] = ltn.normalize_test_names(df3['test'])
 
     global merged
-    merged = df3.merge(ranges, left_on='merge_key', right_on='test', how='outer')
+    # Both sides are keyed on the normalized test name, the catalog's by its index
+    merged = df3.merge(ranges.table.rename_axis('merge_key').reset_index(), on='merge_key', how='outer')
     #merged = df3.drop(columns=['merge_key'])
 
-    # Recategorize based on the above dictionary (i.e. put psa into the prostate category)
-    merged['category'] = merged.apply(lambda row: recategorize(row, category_dict), axis=1)
+    # Move the tests listed in ltn.category_aliases into their categories
+    merged['category'] = ltn.alias_categories(merged['merge_key'], merged['category'])
 
     merged = merged.rename(columns={'test_x':'test'})
 
     # Add a flag column and check ranges
-    merged['flag'] = merged.apply(lambda row: check_range(row['result'], row['range_male']), axis=1)
-    
-    def round_floats(value):
-        # Check if value is already a float
-        if isinstance(value, float):
-            return round(value, 1)
-        # Try to convert string to float and round it
-        try:
-            return round(float(value), 1)
-        except (ValueError, TypeError):
-            return value  # Return original value if not convertible to float
+    merged['flag'] = flag_results(merged['result'], merged)
+    merged = merged.drop(columns=rc.limit_columns)
 
-    # Apply the function to each element of the DataFrame
-    merged = merged.applymap(round_floats)
+    # Round every number in the DataFrame
+    merged = round_floats(merged)
 
 
 
@@ -511,16 +493,20 @@ def main(filename):
     
     global fmerged
     fmerged = merged[selected]
-    fmerged['test'] = fmerged['test'].apply(re_replace_egfrs_with_cystatincegfr)
+    fmerged['test'] = ltn.map_unique(fmerged['test'], ltn.display_test_name)
     print(csv_file)
     fmerged.to_csv(csv_file,index=False)
-    
+
     '''
     f = open(os.path.join(outputdir,'lab_trends.md'),'w')
     f.write(markdown)
     f.close()
     '''
-    return(csv_file, melted_df)
+    # Every file written for this workbook, for the batch manifest
+    return [prep_email_file, patient_note_file, markdown_file, csv_file]
+
+def converted_csv_name(path):
+    return Path(path).name.replace('.xlsx', '.csv')
 
 def convert_xlsx_to_csv(path):
     # Use pandas to read the Excel file and save as CSV
@@ -534,7 +520,7 @@ def convert_xlsx_to_csv(path):
     for col in df.columns:
         if df[col].dtype == 'datetime64[ns]':
             df[col] = df[col].dt.date
-    csv_filename = path.name.replace('.xlsx', '.csv')
+    csv_filename = converted_csv_name(path)
     df.to_csv(csv_filename, index=False)
 
     return csv_filename
@@ -556,9 +542,4 @@ categories = ['lipoproteins','lipids', 'sterols', 'genetics','metabolic markers'
 selected = ['date','test','result','units','range_male','category','flag']
 
 
-#if __name__ == "__main__":
-    #xl_filenames = list_lab_trends_files(path)
-    #while xl_filenames:
-    #filename = convert_xlsx_to_csv(xl_filenames.pop())
-    #print(filename)
-    #main(filename)
\ No newline at end of file
+# To convert a whole folder of workbooks, run batch_lab_trends.py
\ No newline at end of file
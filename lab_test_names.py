@@ -0,0 +1,107 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# Test names that contain one of these keywords (ignoring case) are renamed to the canonical name.
+# When a name contains several keywords, the first one listed wins
+canonical_names = {
+    # Remove test names that also include units -- like lp(a) mg/dl
+    'lp(a)': 'Lp(a)',
+    'apoe': 'ApoE',
+    'egfr': 'egfr',
+    'psa velocity': 'psa velocity',
+}
+
+# Each keyword is tried in turn from the start of the name, so one match finds the highest priority keyword
+canonical_regex = re.compile('|'.join(f'(?=.*?({re.escape(keyword)}))' for keyword in canonical_names), re.I | re.S)
+
+# Names used for the same test by different labs and templates
+equivalent_tests = {
+    'hba1c': ['hga1c', 'hba1c', 'a1c'],
+    'hgb': ['hgb', 'hemoglobin', 'hb'],
+    'vitamin d':['vitd','vitamin d'],
+    'tbili':['tbili','total bilirubin'],
+    'e2': ['e2','estradiol'],
+    'free t': ['free t', 'free testosterone'],
+    'testosterone': ['testosterone','total testosterone', 'total t'],
+    'psa':['PSA','psa'],
+    'hscrp':['hscrp','hs-crp']
+}
+
+# Every name above mapped to the full list of names it's equivalent to
+expanded_equivalents = {name: names for names in equivalent_tests.values() for name in names}
+
+# Tests shown in a different category from the one the sheet lists them under (i.e. put psa into the prostate
+# category), keyed on the normalized test name
+category_aliases = {
+    'psa': 'prostate',
+    'psa velocity': 'prostate',
+    'hb': 'hematology',
+    'ferritin': 'hematology',
+    'iron': 'hematology',
+    'egfr': 'renal',
+    'egfr - cystatin c': 'renal',
+    'egfr by cystatin-c': 'renal',
+    'cystatin c': 'renal',
+    'urinalysis': 'renal',
+    'tsh': 'thyroid',
+    'ft4': 'thyroid',
+    'ft3': 'thyroid',
+    'homocysteine': 'metabolic',
+    'hscrp': 'metabolic',
+    'uric acid': 'metabolic',
+    'vitamin b12': 'vitamins',
+    'vitamin d': 'vitamins',
+    'folate': 'vitamins',
+    'mthfr': 'genetics',
+    'omega-3': 'fatty acids',
+    'lp(a)': 'lipoproteins',
+    # Add more tests and their new categories as necessary.
+}
+
+
+def normalize_test_names(names):
+    """Accepts a Series of test names and returns them stripped and lowercased, for use as lookup keys"""
+    return names.astype(str).str.strip().str.lower()
+
+def normalize_test_name(name):
+    """The lookup key for a single test name, as normalize_test_names makes them"""
+    return str(name).strip().lower()
+
+def matches_test(names, name):
+    """Accepts a Series of test (or category) names and returns a boolean Series, True where it's the same name
+    as the one given once both are normalized"""
+    return normalize_test_names(names) == normalize_test_name(name)
+
+def alias_categories(names, categories):
+    """Accepts Series of test names and of the categories they're listed under and returns the categories
+    with category_aliases applied"""
+    return normalize_test_names(names).map(category_aliases).fillna(categories)
+
+def canonical_test_name(name):
+    """Returns the canonical name for a single test name, or the name unchanged if no keyword matches"""
+    if not isinstance(name, str):
+        return name
+    match = canonical_regex.match(name)
+    if match is None:
+        return name
+    return canonical_names[match.group(match.lastindex).lower()]
+
+def display_test_name(name):
+    """Returns the name a test is shown under in the lab trends outputs"""
+    if isinstance(name, str) and 'egfr' in name.lower():
+        return 'eGFR by Cystatin-C'
+    return name
+
+def map_unique(names, func):
+    """Calls func once for each distinct value in the Series and maps the results back onto every row.
+    Missing values are left as they are"""
+    codes, uniques = pd.factorize(names)
+    mapped = np.array([func(name) for name in uniques] + [None], dtype=object)
+    return pd.Series(np.where(codes >= 0, mapped[codes], names.to_numpy(dtype=object)), index=names.index, name=names.name)
+
+def canonicalize_test_names(names):
+    """Accepts a Series of test names and returns their canonical names"""
+    return map_unique(names, canonical_test_name)
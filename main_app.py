@@ -7,15 +7,25 @@ import pyperclip
 import statistics
 
 import trends_dataframe_functions as tdf
+import lab_test_names as ltn
 from datetime import date
 from trends_constants import categories, tests_to_plot
 import make_trends_pretty as mtp
+import trends_cache as tc
+import results_cache as rcache
+import results_store as rstore
 import blood_pressure_analytics as bpa
 import cgm_plot as cgm
+import cgm_grid as cgmg
+import cgm_ingest as cgmi
+import cgm_metrics as cgmx
+import cgm_plotly as cgmp
+import cgm_store as cgmh
 
 # streamlit_app.py
 
 import hmac
+from contextlib import closing
 import streamlit as st
 
 
@@ -78,12 +88,9 @@ psa_vol = st.sidebar.number_input('PSA Volume')
 a = pd.DataFrame()
 #a.style.format(precision=2,hidd)
 
-if trends_file is not None:
-
-    pretty_trends_html = mtp.main(trends_file)
-    st.sidebar.download_button('Download Pretty Trends', pretty_trends_html, file_name="pretty_trends.html")
-        
-    df = pd.read_excel(trends_file, parse_dates=True, header=None, index_col=None)
+def melt_trends_file(trends_file):
+    """Reads an uploaded trends workbook into one row per test per date, with the patient name in attrs"""
+    df = tc.read_trends_excel(trends_file)
     df = tdf.clean_trends_df(df)
     df = tdf.validate_headers(df)
     df = tdf.format_date_headers(df)
@@ -104,13 +111,7 @@ if trends_file is not None:
     #styled_df = styled_df.set_properties(subset=pd.IndexSlice[cat_rows,:],**{'background-color':'black','color':'white'})
     #styled_df
 
-    # Get name in case we want it, but then immediately over-write if not using
     patient_name = df.columns[0]
-    if patient_name:
-        st.header(patient_name)
-        st.divider()
-    patient_name = '4;tqoiheg;iheg;43htq34d;lkj'
-    del(patient_name)
     df.rename(columns={df.columns[0]:'test'},inplace=True)
     df_melted = pd.melt(df,id_vars=[df.columns[0]],value_name="result",var_name="date")
     df_melted = tdf.add_category_column(df_melted,categories)
@@ -118,13 +119,32 @@ if trends_file is not None:
     df_melted_nocat = df_melted_nocat.copy()
     #df_melted_nocat["date"] = pd.to_datetime(df_melted_nocat["date"], format='%m/%d/%Y', errors='coerce')
     df_melted_nocat["date"] = pd.to_datetime(df_melted_nocat["date"],errors='ignore')
+    df_melted_nocat.attrs['patient_name'] = patient_name
+    return df_melted_nocat
+
+if trends_file is not None:
+
+    # Both the pretty trends and the category tables come from the same cached parse of the upload
+    # The HTML is streamed into a buffer for the button rather than built up as one string
+    pretty_trends_html = mtp.html_buffer(mtp.report_df(trends_file))
+    st.sidebar.download_button('Download Pretty Trends', pretty_trends_html, file_name="pretty_trends.html", mime='text/html')
+        
+    # The long-format results come from the results cache when this exact workbook has been seen before
+    df_melted_nocat = rcache.cached_results(trends_file, 'trends', melt_trends_file)
+
+    # Get name in case we want it, but then immediately over-write if not using
+    patient_name = df_melted_nocat.attrs.get('patient_name')
+    if patient_name:
+        st.header(patient_name)
+        st.divider()
+    patient_name = '4;tqoiheg;iheg;43htq34d;lkj'
+    del(patient_name)
         
     # Make tables to display the dataframe for each category of test separately
     for cat in categories:
     
         # Query the larger dataframe for tests that fall into a specific category
-        query = 'category.str.lower() == @cat and test.str.lower() != @cat'
-        df = df_melted_nocat.query(query)
+        df = df_melted_nocat[ltn.matches_test(df_melted_nocat['category'], cat) & ~ltn.matches_test(df_melted_nocat['test'], cat)]
 
         # If the query is blank, continue the loop and skip to the next category
         if df.empty:
@@ -146,14 +166,14 @@ if trends_file is not None:
 
         # If any of the tests to plot are in this category, go ahead and plot them
         # Find intersection of the tests we want to plot and the pivot index, which is the 'test' col
-        tests_in_cat = set(test.lower() for test in tests_to_plot) & set(test_name.lower() for test_name in pivot['test'])
+        tests_in_cat = set(ltn.normalize_test_name(test) for test in tests_to_plot) & set(ltn.normalize_test_names(pivot['test']))
         for test in tests_in_cat:
             fig = tdf.create_plotly_line_plot_of_metric(df_melted_nocat,test)
             if fig:
                 st.plotly_chart(fig)
             if test == 'psa' and psa_vol:
                 #print(df_melted[df_melted['test'].str.lower() == "psa"])
-                psa_df = df_melted_nocat.query('test.str.lower() == "psa"')
+                psa_df = df_melted_nocat[ltn.matches_test(df_melted_nocat['test'], 'psa')]
                 psa_df = psa_df[psa_df['result'] != '']
                 psa_df['date'] = pd.to_datetime(psa_df['date'])
                 
@@ -182,10 +202,66 @@ if trends_file is not None:
 #    pass
 
 
+# Point lookups across every patient imported by convert_lab_trends
+lookup_test = st.sidebar.text_input('Latest Result for All Patients', help="Test name, like ApoB")
+if lookup_test:
+    with closing(rstore.connect()) as conn:
+        latest = rstore.latest_for_test(conn, lookup_test)
+    st.subheader(f'Latest {lookup_test} for all patients', divider=True)
+    st.dataframe(latest, hide_index=True)
+
+
 cgm_csv = st.sidebar.file_uploader('Upload CGM CSV')
-if cgm_csv is not None:
-    plot = cgm.create_cgm_plot(cgm_csv)
-    st.pyplot(plot)
+cgm_source = cgm_csv
+
+# Uploads can be added to a patient's CGM history, and the plots then show a window of the whole history
+cgm_patient = st.sidebar.text_input('CGM History Patient', help="Shows this patient's stored readings")
+if cgm_patient:
+    # Only written when asked, not on every rerun of the script
+    if cgm_csv is not None and st.sidebar.button('Add Upload to CGM History'):
+        added = cgmh.append_readings(cgm_patient, cgmi.read_cgm(cgm_csv))
+        st.sidebar.write(f'{added:,} new readings added for {cgm_patient}')
+    cgm_window = st.sidebar.selectbox('CGM Window', list(cgmh.history_windows))
+    cgm_source = cgmh.read_named_window(cgm_patient, cgm_window)
+    # Until anything is stored for them, show the upload by itself
+    if cgm_source.empty:
+        cgm_source = cgm_csv
+
+if cgm_source is not None:
+    cgm_readings = cgmi.cgm_readings(cgm_source)
+    # Put the readings on the regular grid once, for every chart and metric below. By default the grid follows
+    # the sensor's own spacing (e.g. every minute for 1-minute Libre data)
+    cgm_step = st.sidebar.selectbox('CGM Grid Minutes', [None] + cgmg.grid_steps,
+                                    format_func=lambda step: 'From the readings' if step is None else step)
+    cgm_max_gap = st.sidebar.number_input('CGM Max Gap Minutes', min_value=1, value=None, placeholder='Default',
+                                          help="Longer stretches without readings are left as gaps rather than interpolated")
+    cgm_grid = cgmg.regularize(cgm_readings, cgm_step, cgm_max_gap)
+    if st.sidebar.toggle('Interactive CGM View', help="Zoomable charts of the readings, downsampled to the point budget"):
+        point_budget = st.sidebar.number_input('CGM Point Budget', min_value=100, value=cgmp.cgm_point_budget, step=500)
+        st.plotly_chart(cgmp.create_cgm_series_fig(cgm_grid, point_budget))
+        st.plotly_chart(cgmp.create_cgm_profile_fig(cgm_grid, point_budget))
+        st.plotly_chart(cgmp.create_cgm_day_heatmap_fig(cgm_grid))
+        st.plotly_chart(cgmp.create_weekday_heatmap_fig(cgm_grid))
+    else:
+        # Splitting the readings at a date (e.g. a change in therapy) compares the profiles before and after it
+        cgm_split = st.sidebar.date_input('Compare CGM Before/After', value=None)
+        cgm_periods = None
+        if cgm_split is not None:
+            cgm_periods = [(cgm_readings['Datetime'].min(), pd.Timestamp(cgm_split) - pd.Timedelta(days=1)),
+                           (pd.Timestamp(cgm_split), cgm_readings['Datetime'].max())]
+        plot = cgm.create_cgm_plot(cgm_grid, cgm_periods)
+        st.pyplot(plot)
+        if cgm_periods:
+            st.dataframe(cgmx.period_metrics(cgm_grid, cgm_periods).round(1))
+        st.pyplot(cgm.create_cgm_heatmaps(cgm_grid))
+
+    # Summary metrics for the same readings. On the regular grid each reading stands for the same length of time,
+    # and the gaps give the sensor's coverage
+    cgm_summary = cgmx.glucose_metrics(cgm_grid)
+    if cgm_summary['Readings']:
+        metric_columns = st.columns(4)
+        for i, (label, value) in enumerate(cgm_summary.items()):
+            metric_columns[i % 4].metric(label, f'{value:,}' if label == 'Readings' else f'{value:.1f}')
 
 
 if st.sidebar.button('Analyze BPs on Clipboard'):
@@ -1,17 +1,22 @@
 import pandas as pd
+import numpy as np
 import re
 from datetime import datetime
+import io
+import os
 import sys
 
+import trends_cache as tc
+import trends_dataframe_functions as tdf
 
 #sys.path.insert(0,"/Users/sk/Library/Python/3.9/bin")
 #import weasyprint
 
 def read_and_clean_excel(file_path):
-    df = pd.read_excel(file_path, parse_dates=True, header=None, index_col=None)
+    df = tc.read_trends_excel(file_path)
     
     # Find the header row (containing 'Ref range')
-    ref_index = df[df.map(lambda x: x == 'Ref range')].any(axis=1).idxmax()
+    ref_index = tdf.detect_layout(df)['header_row']
     
     # Set the columns based on the identified header row
     df.columns = df.iloc[ref_index]
@@ -36,71 +41,13 @@ def read_and_clean_excel(file_path):
     return df
 
 def validate_data(df):
-    # Define a regex pattern to match the 'Lastname, Firstname' format
-    name_pattern = r"^(?!.*?\b(?:last\s+name\s*,\s*first\s+name|last\s*,\s*first)\b)\s*[A-Za-z\- '\.]+(, Jr\.?|, Sr\.?|, I{1,3}|, IV|, V|, VI|, VII|, VIII|, IX|, X)?\s*,\s*[A-Za-z\- '\.]+\s*$"
-   
-    valid_columns = []
-    
-    for col in df.columns:
-        col_str = str(col).strip()
-        
-        # Check if the column header matches the 'Lastname, Firstname' format
-        if re.match(name_pattern, col_str, re.I):
-            valid_columns.append(col)
-        else:
-            # Try interpreting the column as a date
-            try:
-                pd.to_datetime(col_str)
-                valid_columns.append(col)
-            except:
-                pass
-
-        # Check if the column header is the 'Reference' column
-        if col_str == "Reference":
-            valid_columns.append(col)
-    
-    # Keep only the valid columns
-    df = df[valid_columns]
-    return df
-
-
-
-
-
+    return tdf.validate_headers(df)
 
 def format_date_headers(df):
-    formatted_headers = []
-    for header in df.columns:
-        try:
-            # Attempt to convert the header to a date and format it
-            formatted_date = pd.to_datetime(header).strftime('%m/%d/%y')
-            formatted_headers.append(formatted_date)
-        except:
-            # If it's not a date or can't be formatted, keep the original header
-            formatted_headers.append(header)
-    
-    df.columns = formatted_headers
-    return df
+    return tdf.format_date_headers(df)
 
 def sort_columns_reverse_chronological(df):
-    # Identify date columns and non-date columns
-    date_cols = []
-    non_date_cols = []
-    for col in df.columns:
-        try:
-            pd.to_datetime(col)
-            date_cols.append(col)
-        except:
-            non_date_cols.append(col)
-
-    # Sort the date columns in reverse chronological order
-    sorted_date_cols = sorted(date_cols, key=pd.to_datetime, reverse=True)
-    
-    # Concatenate the columns back together
-    sorted_cols = non_date_cols + sorted_date_cols
-    df = df[sorted_cols]
-    
-    return df
+    return tdf.sort_columns_reverse_chronological(df)
 
 
 
@@ -125,13 +72,7 @@ def apply_formatting(df):
     df = df.map(lambda x: '{:.1f}'.format(float(x)) if isinstance(x, (float, str)) and is_convertible_to_float(x) else x)
     
     # Identify category rows
-    def is_blank_or_alpha(val):
-        return pd.isna(val) or isinstance(val, str) and (val.strip() == '' or re.match(r'^[A-Za-z ]+$', val))
-
-
-    df['is_category'] = df.apply(lambda row: all(is_blank_or_alpha(val) for val in row), axis=1)
-
-    non_category_rows = df[df['is_category'] == False]
+    df = tdf.id_category_rows(df)
     
     return df
 
@@ -143,75 +84,47 @@ def is_date(string):
         return False
     
 def identify_date_columns(df):
-    date_columns = [col for col in df.columns if is_date(col)]
-    return date_columns
+    return tdf.identify_date_columns(df)
     
 def spell_out_date_headers(df):
     # Identify date columns based on a stricter pattern check
-    date_columns = identify_date_columns(df)
+    date_columns = tdf.classify_headers(identify_date_columns(df))
     
     # Sort columns in descending order to start with the most recent date
-    date_columns.sort(key=lambda date: datetime.strptime(date, '%m/%d/%y'), reverse=True)
+    date_columns.sort(key=lambda info: info.timestamp, reverse=True)
 
-    for i in range(len(date_columns)):
-        dt_obj = datetime.strptime(date_columns[i], '%m/%d/%y')
-                
-        # If there's a next date (i.e. previous in chronological order)
-        if i+1 < len(date_columns):
-            next_dt_obj = datetime.strptime(date_columns[i+1], '%m/%d/%y')
-            elapsed_weeks = (dt_obj - next_dt_obj).days // 7
-            elapsed_str = f"{elapsed_weeks} weeks elapsed"
+    renamed = {}
+    for info in date_columns:
+        # If there's a previous draw, say how long ago it was
+        if info.weeks_elapsed is not None:
+            elapsed_str = f"{info.weeks_elapsed} weeks elapsed"
         else:
             elapsed_str = "Initial Draw"
         date_tip_str = f"<div class='date_tip'>%A<br>%m.%d.%y<br>{elapsed_str}</div>"
         date_str = "%b<br><span class='year'>%Y</span>"
-        new_col_name = dt_obj.strftime(f"<div class='header-content'>{date_str}{date_tip_str}</div>")
-        df.rename(columns={date_columns[i]: new_col_name}, inplace=True)
+        renamed[info.header] = info.timestamp.strftime(f"<div class='header-content'>{date_str}{date_tip_str}</div>")
+    df.rename(columns=renamed, inplace=True)
 
     return df
 
 def to_markdown(df):
     return df.to_markdown(index=False)
 
-def to_html(df):
-        # Base styles
-    styles = {
-        "font-family": "Avenir LT Std 55 Roman",
-        "border": "1px solid #e0e0e0",
-        "border-collapse": "collapse",
-        "text-align": "left",
-        "padding": "10px 15px"
-    }
-
-    # Convert dictionary of styles to a single string
-    style_str = "; ".join([f"{key}: {value}" for key, value in styles.items()])
+# Base styles for the tables written by to_html
+table_cell_styles = {
+    "font-family": "Avenir LT Std 55 Roman",
+    "border": "1px solid #e0e0e0",
+    "border-collapse": "collapse",
+    "text-align": "left",
+    "padding": "10px 15px"
+}
 
-    # Hover effects for cells
-    hover_effect = {
-        "selector": "tbody tr:hover td, tbody tr:hover th",
-        "props": [("background-color", "rgba(218, 89, 85, 0.5)")]
-    }
-
-    alternate_row_color = {
-        "selector": "tbody tr:nth-child(even)",
-        "props": [("background-color", "#f7f7f7")]
-    }
-
-    no_wrap_style = {
-        "selector": "td, th",
-        "props": [("white-space", "nowrap")]
-    }
-
-    table_auto_layout = {
-        "selector": "table",
-        "props": [("table-layout", "auto")]
-    }
-
-    # Create the Styler object
-    styled = df.style.set_table_attributes(f'style="{style_str}"').set_properties(**styles)
+# The base styles as a single style attribute for the table
+table_style_attribute = "; ".join([f"{key}: {value}" for key, value in table_cell_styles.items()])
 
+table_styles = [
     # Header style (sticky)
-    header_style = {
+    {
         "selector": "thead th",
         "props": [
             ("font-family", "Avenir"),
@@ -222,20 +135,16 @@ def to_html(df):
             ("top", "0"),  # Stick to the top
             ("z-index", "1"),  # Ensure header is on top of content
         ]
-    }
-
-    # Apply all styles
-    all_styles = [header_style, hover_effect, alternate_row_color, no_wrap_style, table_auto_layout]
-    styled = styled.set_table_styles(all_styles)
-
-    # Convert the DataFrame to HTML
-    table_html = styled.to_html(index=False)
-
-    # Wrap the first column in a separate div for sticky effect
-    first_col_sticky = f'<div class="sticky-first-col">{table_html}</div>'
-
-    # Apply CSS to make the first column sticky
-    style = '''
+    },
+    # Hover effects for cells
+    {"selector": "tbody tr:hover td, tbody tr:hover th", "props": [("background-color", "rgba(218, 89, 85, 0.5)")]},
+    {"selector": "tbody tr:nth-child(even)", "props": [("background-color", "#f7f7f7")]},
+    {"selector": "td, th", "props": [("white-space", "nowrap")]},
+    {"selector": "table", "props": [("table-layout", "auto")]},
+]
+
+# CSS to make the first column sticky
+sticky_first_col_css = '''
         <style>
             .sticky-first-col {
                 overflow-x: auto;
@@ -251,8 +160,19 @@ def to_html(df):
         </style>
     '''
 
+def to_html(df):
+    # Create the Styler object
+    styled = df.style.set_table_attributes(f'style="{table_style_attribute}"').set_properties(**table_cell_styles)
+    styled = styled.set_table_styles(table_styles)
+
+    # Convert the DataFrame to HTML
+    table_html = styled.to_html(index=False)
+
+    # Wrap the first column in a separate div for sticky effect
+    first_col_sticky = f'<div class="sticky-first-col">{table_html}</div>'
+
     # Combine the style and table HTML
-    full_html = f'{style}{first_col_sticky}'
+    full_html = f'{sticky_first_col_css}{first_col_sticky}'
 
     return full_html
 
@@ -260,28 +180,30 @@ def save_to_files(df, md_file, html_file):
     with open(md_file, 'w') as file:
         file.write(to_markdown(df))
     
-    # Convert to HTML with category row classes
+    # Convert to HTML with category row classes. Only the body rows are counted, so they line up with df's rows
     html_content = to_html(df)
-    lines = html_content.split('\n')
+    head, body = html_content.split('<tbody>', 1)
+    lines = body.split('\n')
     modified_lines = []
     row_index = 0  # Initialize the row index
     for line in lines:
         if '<tr>' in line:
             if row_index < df.shape[0]:  # Check if the row index is within bounds
-                if df.iloc[row_index, -1]:
+                if df['is_category'].iloc[row_index]:
                     line = line.replace('<tr>', '<tr class="category-row">')
                 row_index += 1  # Increment the row index
         modified_lines.append(line)
     
-    modified_html_content = '\n'.join(modified_lines)
+    modified_html_content = head + '<tbody>' + '\n'.join(modified_lines)
 
     with open(html_file, 'w') as file:
         file.write(modified_html_content)
 
-def generate_html(df):
-    print
-    # Start the HTML with the base structure and styles
-    html = """
+# Table rows are rendered and yielded this many at a time
+html_chunk_rows = 256
+
+# Everything in a pretty trends report before the table
+report_head = """
     <html>
     <head>
         <style>
@@ -520,60 +442,9 @@ def generate_html(df):
     
         <table>
     """
-    
-    # Attempt to convert the column headers to dates and store them in a list
-    date_cols = []
-    for col in df.columns:
-        try:
-            date_obj = pd.to_datetime(col)
-            date_cols.append(date_obj)
-        except:
-            # If conversion fails, it's not a date string
-            pass
-
-    # Find the most recent date
-    most_recent_date = max(date_cols) if date_cols else None
-
-    if most_recent_date:
-        most_recent_date = most_recent_date.strftime('%m/%d/%y')
-    else:
-        most_recent_date = None
-
-    print(most_recent_date)
-
-    # The rest of the code remains the same
-
 
-    # Start generating the HTML table with headers
-    html += "<table><thead><tr>"
-
-    # Generate headers
-    for col in df.columns:
-        if col != 'is_category':
-            if col == most_recent_date:
-                html += f'<th data-latest="true">{col}</th>'
-            else:
-                html += f'<th><span>{col}</span></th>'
-    html += "</tr></thead><tbody>"
-
-    # Loop through rows to generate table data
-    for _, row in df.iterrows():
-        if row["is_category"]:
-            html += '<tr class="category-row">'
-        else:
-            html += "<tr>"
-        for col in df.columns:
-            if col != 'is_category':  # Exclude the 'is_category' column
-                if col == most_recent_date:
-                    html += f'<td data-latest="true">{row[col]}</td>'
-                else:
-                    html += f'<td>{row[col]}</td>'
-        html += "</tr>"
-
-
-    
-    # Close the HTML tags
-    html += """
+# Everything in a pretty trends report after the table
+report_tail = """
         </tbody>
         
         </table>
@@ -648,14 +519,96 @@ def generate_html(df):
     </body>
     </html>
     """
+
+# The stylesheet and script embedded above, which batch exports can share as separate files instead
+report_css = report_head[report_head.index('<style>') + len('<style>'):report_head.index('</style>')]
+report_js = report_tail[report_tail.index('<script>') + len('<script>'):report_tail.index('</script>')]
+report_css_file = 'pretty_trends.css'
+report_js_file = 'pretty_trends.js'
+
+linked_report_head = report_head.replace(f'<style>{report_css}</style>', f'<link rel="stylesheet" href="{report_css_file}">')
+linked_report_tail = report_tail.replace(f'<script>{report_js}</script>', f'<script src="{report_js_file}"></script>')
+
+def report_parts(linked_assets=False):
+    """Returns the (head, tail) to wrap a report's table in, either with the stylesheet and script inline
+    or linking to the files written by write_report_assets"""
+    if linked_assets:
+        return linked_report_head, linked_report_tail
+    return report_head, report_tail
+
+def write_report_assets(directory):
+    """Writes the shared stylesheet and script for linked reports into directory and returns their paths"""
+    css_path = os.path.join(directory, report_css_file)
+    js_path = os.path.join(directory, report_js_file)
+    with open(css_path, 'w') as file:
+        file.write(report_css)
+    with open(js_path, 'w') as file:
+        file.write(report_js)
+    return css_path, js_path
+
+def iter_html(df, chunk_rows=html_chunk_rows, linked_assets=False):
+    """Renders the pretty trends table for df as a sequence of HTML strings, so the document
+    can be written out piece by piece instead of being built up in memory.
+    With linked_assets the report links to the shared stylesheet and script instead of embedding them"""
+    # Start the HTML with the base structure and styles
+    head, tail = report_parts(linked_assets)
+    yield head
     
-    return html
+    # Find the column headers that are dates
+    date_cols = [info.timestamp for info in tdf.classify_headers(df.columns) if info.is_date]
+
+    # Find the most recent date
+    most_recent_date = max(date_cols) if date_cols else None
+
+    if most_recent_date:
+        most_recent_date = most_recent_date.strftime('%m/%d/%y')
+    else:
+        most_recent_date = None
+
+    # Start generating the HTML table with headers
+    columns = [col for col in df.columns if col != 'is_category']
+    headers = "".join(f'<th data-latest="true">{col}</th>' if col == most_recent_date else f'<th><span>{col}</span></th>' for col in columns)
+    yield f"<table><thead><tr>{headers}</tr></thead><tbody>"
+
+    # Pull the cells out once, and work out each row's and each column's opening tag up front
+    cells = df[columns].to_numpy(dtype=object)
+    row_tags = np.where(df['is_category'].to_numpy(dtype=bool), '<tr class="category-row">', '<tr>').astype(object)
+    cell_tags = ['<td data-latest="true">' if col == most_recent_date else '<td>' for col in columns]
+
+    # Build a block of rows at a time, one column at a time
+    for start in range(0, len(cells), chunk_rows):
+        block = cells[start:start + chunk_rows]
+        rows = row_tags[start:start + chunk_rows]
+        for i, cell_tag in enumerate(cell_tags):
+            rows = rows + cell_tag + block[:, i].astype(str).astype(object) + '</td>'
+        yield "".join(rows + "</tr>")
+
 
-def save_html_to_file(df, html_file):
-    html_content = generate_html(df)
     
+    # Close the HTML tags
+    yield tail
+
+def generate_html(df, linked_assets=False):
+    return "".join(iter_html(df, linked_assets=linked_assets))
+
+def write_html(df, file, linked_assets=False):
+    """Streams the pretty trends HTML into an open text file"""
+    file.writelines(iter_html(df, linked_assets=linked_assets))
+
+def save_html_to_file(df, html_file, linked_assets=False):
     with open(html_file, 'w') as file:
-        file.write(html_content)
+        write_html(df, file, linked_assets)
+
+def html_buffer(df, linked_assets=False):
+    """Streams the pretty trends HTML as UTF-8 into an in-memory binary file, rewound and ready to be read,
+    e.g. by a download button"""
+    buffer = io.BytesIO()
+    text = io.TextIOWrapper(buffer, encoding='utf-8', write_through=True)
+    write_html(df, text, linked_assets)
+    # Let go of the buffer without closing it
+    text.detach()
+    buffer.seek(0)
+    return buffer
 
 
 def open_file():
@@ -673,17 +626,16 @@ def processed_df(input_file):
     #df = spell_out_date_headers(df)
     return df
 
-def main(path):
+def report_df(path):
+    """The workbook at path as the pretty trends table shows it"""
+    return spell_out_date_headers(processed_df(path))
+
+def main(path, linked_assets=False):
   
     input_file=path
     # Example usage:
-    df = read_and_clean_excel(input_file)
-    df = validate_data(df)
-    df = format_date_headers(df)
-    df = apply_formatting(df)
-    df = sort_columns_reverse_chronological(df)
-    df = spell_out_date_headers(df)
-    html_content = generate_html(df)
+    df = report_df(input_file)
+    html_content = generate_html(df, linked_assets)
 
     
     #save_to_files(df, "output.md", "output.html")
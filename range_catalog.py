@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from lab_test_names import normalize_test_names
+
+
+# Columns added to the ranges file by parse_range_limits
+limit_columns = ['lower', 'upper', 'kind']
+
+
+def parse_range_limits(range_strings):
+    """Accepts a Series of reference range strings and returns a DataFrame with the same index
+    holding numeric 'lower' and 'upper' limits and the 'kind' of range: '<' for '<x', '>' for '>x' or '-' for 'a-b'.
+    Ranges in any other format get NaN limits and no kind"""
+    text = range_strings.astype(str).str.strip()
+
+    is_below = text.str.startswith('<')
+    is_above = text.str.startswith('>')
+    is_between = ~is_below & ~is_above & (text.str.count('-') == 1)
+
+    # '<x' and '>x' have a single limit after the sign
+    limit = pd.to_numeric(text.str[1:].str.strip(), errors='coerce')
+
+    # 'a-b' has a limit on each side of the dash
+    sides = text.where(is_between, '').str.partition('-')
+    lower = pd.to_numeric(sides[0].str.strip(), errors='coerce')
+    upper = pd.to_numeric(sides[2].str.strip(), errors='coerce')
+
+    limits = pd.DataFrame(index=range_strings.index)
+    limits['lower'] = np.where(is_above, limit, np.where(is_between, lower, np.nan))
+    limits['upper'] = np.where(is_below, limit, np.where(is_between, upper, np.nan))
+    limits['kind'] = np.select([is_below, is_above, is_between], ['<', '>', '-'], default=None)
+    return limits
+
+
+class RangeCatalog:
+    """The ideal lab ranges file, read once and indexed by normalized test name.
+    The file is re-read whenever its modification time changes, and a Parquet copy of the parsed table
+    is kept next to it so a new process doesn't have to parse the CSV again"""
+
+    def __init__(self, path):
+        self.path = path
+        self.sidecar_path = f'{path}.catalog.parquet'
+        self._stamp = None
+        self._table = None
+        self._by_name = None
+
+    @property
+    def table(self):
+        """The ranges file as read, plus the numeric limits of range_male, indexed by normalized test name"""
+        self.refresh()
+        return self._table
+
+    @property
+    def ranges(self):
+        """The ranges file as read, indexed by normalized test name"""
+        return self.table.drop(columns=limit_columns)
+
+    def refresh(self):
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+
+        table = self._read_sidecar(stamp)
+        if table is None:
+            table = pd.read_csv(self.path)
+            table.index = normalize_test_names(table['test'])
+            table.index.name = None
+            table[limit_columns] = parse_range_limits(table['range_male'])
+            self._write_sidecar(stamp, table)
+
+        self._table = table
+        self._by_name = table[~table.index.duplicated(keep='first')]
+        self._stamp = stamp
+
+    def _read_sidecar(self, stamp):
+        # Anything wrong with the sidecar (missing, cut short, written by another version) just means
+        # parsing the CSV again
+        try:
+            table = pd.read_parquet(self.sidecar_path)
+        except Exception:
+            return None
+        if table.attrs.get('stamp') != list(stamp):
+            return None
+        return table
+
+    def _write_sidecar(self, stamp, table):
+        # The stamp of the ranges file it was parsed from goes in the Parquet metadata
+        table.attrs['stamp'] = list(stamp)
+        # Written to the side and swapped in, so a process reading it never sees half a file.
+        # The sidecar only speeds up the next cold start, so a read-only share isn't an error
+        temp_path = f'{self.sidecar_path}.tmp'
+        try:
+            table.to_parquet(temp_path)
+            os.replace(temp_path, self.sidecar_path)
+        except (OSError, ValueError):
+            pass
+
+    def contains(self, test_names):
+        """Returns a boolean array, True where the test name has a range"""
+        self.refresh()
+        return normalize_test_names(test_names).isin(self._by_name.index).to_numpy()
+
+    def lookup(self, test_names):
+        """Accepts a Series of test names and returns the matching catalog rows with the same index,
+        all NaN for tests without a range"""
+        self.refresh()
+        found = self._by_name.reindex(normalize_test_names(test_names))
+        found.index = test_names.index
+        return found
+
+
+# One catalog per ranges file for the life of the process
+catalogs = {}
+
+def get_range_catalog(path):
+    catalog = catalogs.get(path)
+    if catalog is None:
+        catalog = catalogs[path] = RangeCatalog(path)
+    return catalog
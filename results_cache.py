@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import trends_cache as tc
+
+
+# Where the per-workbook Parquet files go. Files are named by a hash of the workbook's content, results_cache_version
+# and anything else the results depend on, so an edited workbook simply gets a new file
+results_cache_dir = os.environ.get('TRENDS_RESULTS_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'lab_trends'))
+
+# Upper bound on the disk space the cached files take up, in megabytes. The least recently used go first
+max_results_cache_mb = float(os.environ.get('TRENDS_RESULTS_CACHE_MAX_MB', 512))
+
+# Bump whenever a change to the pipelines or to to_columnar changes the cached results, so older files are not read
+results_cache_version = 2
+
+# The long-format results, one row per test per date
+result_columns = ['test', 'result', 'date', 'category', 'flag']
+
+
+def cache_path(key, kind):
+    return os.path.join(results_cache_dir, f'{key}.{kind}.parquet')
+
+def to_columnar(results):
+    """Converts a long-format results frame, whose 'result' column mixes numbers and text, into typed columns:
+    numbers go in a float 'value' column and everything else stays in 'result' as a string"""
+    table = pd.DataFrame(index=results.index)
+    table['test'] = results['test'].astype('string')
+
+    cells = results['result'].to_numpy(dtype=object)
+    is_number = np.array([isinstance(cell, (int, float, np.number)) and not isinstance(cell, bool) for cell in cells], dtype=bool)
+    table['value'] = pd.Series(np.where(is_number, cells, np.nan), index=results.index, dtype='float64')
+    table['result'] = pd.Series(np.where(is_number, None, cells), index=results.index, dtype=object).astype('string')
+
+    # Like pd.to_datetime(errors='ignore'), the dates stay as text if any of them can't be parsed
+    dates = pd.to_datetime(results['date'], format='mixed', errors='coerce')
+    table['date'] = dates if dates.notna().sum() == results['date'].notna().sum() else results['date'].astype('string')
+    table['category'] = results['category'].astype('category')
+    table['flag'] = results['flag'].astype('category') if 'flag' in results else pd.Categorical([None] * len(results))
+    return table.reset_index(drop=True)
+
+def from_columnar(table):
+    """Inverse of to_columnar: returns the results with plain object columns, numbers back in 'result'
+    and 'date' as timestamps"""
+    results = pd.DataFrame(index=table.index)
+    results['test'] = table['test'].astype(object).where(table['test'].notna(), None)
+    results['result'] = table['value'].astype(object).where(table['result'].isna(), table['result'].astype(object))
+    results['date'] = table['date'] if pd.api.types.is_datetime64_any_dtype(table['date']) else table['date'].astype(object).where(table['date'].notna(), None)
+    results['category'] = table['category'].astype(object).where(table['category'].notna(), None)
+    results['flag'] = table['flag'].astype(object).where(table['flag'].notna(), None)
+    results.attrs.update(table.attrs)
+    return results
+
+def load_results(key, kind):
+    """Returns the cached results for the key results_key made, or None"""
+    try:
+        table = pd.read_parquet(cache_path(key, kind))
+        # Marks the file as recently used, so pruning keeps it
+        os.utime(cache_path(key, kind))
+    except (OSError, ValueError):
+        return None
+    return from_columnar(table)
+
+def prune_cache(max_bytes=None):
+    """Deletes the least recently used cached files until they take up no more than max_bytes
+    (max_results_cache_mb by default), always keeping the newest"""
+    if max_bytes is None:
+        max_bytes = int(max_results_cache_mb * 1024 * 1024)
+    try:
+        entries = [entry for entry in os.scandir(results_cache_dir) if entry.is_file() and entry.name.endswith('.parquet')]
+    except OSError:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+    total_bytes = sum(entry.stat().st_size for entry in entries)
+    for entry in entries[:-1]:
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(entry.path)
+        except OSError:
+            continue
+        total_bytes -= entry.stat().st_size
+
+def save_results(key, kind, table):
+    """Writes the typed table from to_columnar"""
+    # The cache only saves time, so failing to write it (read-only home, full disk) isn't an error
+    try:
+        os.makedirs(results_cache_dir, exist_ok=True)
+        temp_path = f'{cache_path(key, kind)}.tmp'
+        table.to_parquet(temp_path, index=False)
+        os.replace(temp_path, cache_path(key, kind))
+    except OSError:
+        pass
+    prune_cache()
+
+def store_results(key, kind, results):
+    """Caches results as build made them (attrs included) and returns them as a cache hit would"""
+    table = to_columnar(results)
+    table.attrs.update(results.attrs)
+    save_results(key, kind, table)
+    return from_columnar(table)
+
+def results_key(file, depends_on=()):
+    """The cache key for a workbook (a path or an upload): a hash of its content, results_cache_version and
+    depends_on, e.g. the hash of a ranges file its results were flagged with"""
+    parts = [tc.content_hash(tc.read_file_bytes(file)), str(results_cache_version)] + [str(part) for part in depends_on]
+    return tc.content_hash(':'.join(parts).encode())
+
+def cached_results(file, kind, build, depends_on=()):
+    """Returns the results for a workbook (a path or an upload), calling build(file) to make them only if
+    there's no cached copy for this exact content and depends_on. kind keeps apart the differently shaped results
+    of different pipelines. Anything build puts in the frame's attrs is cached along with it"""
+    key = results_key(file, depends_on)
+    results = load_results(key, kind)
+    if results is None:
+        # Hand back the same form a cache hit would, whichever way the results were found
+        results = store_results(key, kind, build(file))
+    return results
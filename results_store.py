@@ -0,0 +1,150 @@
+import os
+import sqlite3
+import warnings
+from datetime import datetime
+
+import pandas as pd
+
+import results_cache as rcache
+from lab_test_names import normalize_test_names
+
+
+# One database for every patient, kept with the results cache unless TRENDS_RESULTS_DB says otherwise
+results_db_file = os.environ.get('TRENDS_RESULTS_DB', os.path.join(rcache.results_cache_dir, 'lab_results.sqlite'))
+
+schema = '''
+    CREATE TABLE IF NOT EXISTS patients (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        source_hash TEXT,
+        imported_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS tests (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        display_name TEXT
+    );
+    CREATE TABLE IF NOT EXISTS results (
+        patient_id INTEGER NOT NULL REFERENCES patients(id),
+        test_id INTEGER NOT NULL REFERENCES tests(id),
+        date TEXT NOT NULL,
+        result TEXT,
+        value REAL,
+        category TEXT,
+        flag TEXT,
+        PRIMARY KEY (patient_id, test_id, date)
+    );
+    CREATE INDEX IF NOT EXISTS results_by_test_date ON results (test_id, date);
+'''
+
+
+def connect(path=None):
+    """Opens the results database, creating it if needed.
+    Several batch workers can import at once, so writers wait on each other instead of failing"""
+    path = path or results_db_file
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(schema)
+    return conn
+
+def import_results(conn, patient, results, source_hash=None):
+    """Adds a patient's long-format results (test, result, date and optionally category and flag) to the store.
+    A patient's sheet holds all their results, so importing one replaces whatever was stored for them before,
+    including results since taken off the sheet. Blank results are skipped. Where two results have the same
+    test (once the names are normalized) and date, the later one is kept and a warning says which were dropped"""
+    results = results[results['result'].astype(str).str.strip() != '']
+    dates = pd.to_datetime(results['date'], format='mixed', errors='coerce')
+    results = results[dates.notna()]
+
+    test_keys = normalize_test_names(results['test'])
+    rows = pd.DataFrame({
+        'test': test_keys,
+        'date': dates[dates.notna()].dt.strftime('%Y-%m-%d'),
+        'result': results['result'].astype(str),
+        'value': pd.to_numeric(results['result'], errors='coerce'),
+        'category': results['category'] if 'category' in results else None,
+        'flag': results['flag'] if 'flag' in results else None,
+    })
+    duplicated = rows.duplicated(['test', 'date'], keep='last')
+    if duplicated.any():
+        dropped = ', '.join(f'{test} on {date}' for test, date in rows.loc[duplicated, ['test', 'date']].drop_duplicates().itertuples(index=False))
+        warnings.warn(f'{patient} has more than one result for {dropped}; keeping the last of each')
+        rows = rows[~duplicated]
+    rows = rows.astype(object).where(rows.notna(), None)
+    display_names = results['test'].groupby(test_keys).first()
+
+    with conn:
+        conn.execute(
+            'INSERT INTO patients (name, source_hash, imported_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET source_hash = excluded.source_hash, imported_at = excluded.imported_at',
+            (patient, source_hash, datetime.now().isoformat(timespec='seconds')))
+        patient_id = conn.execute('SELECT id FROM patients WHERE name = ?', (patient,)).fetchone()[0]
+
+        conn.executemany(
+            'INSERT INTO tests (name, display_name) VALUES (?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET display_name = excluded.display_name',
+            list(display_names.items()))
+        test_ids = dict(conn.execute('SELECT name, id FROM tests'))
+
+        # In the same transaction as the inserts, so readers never see the patient without results
+        conn.execute('DELETE FROM results WHERE patient_id = ?', (patient_id,))
+        conn.executemany(
+            'INSERT INTO results (patient_id, test_id, date, result, value, category, flag) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(patient_id, test_ids[test], date, result, value, category, flag)
+             for test, date, result, value, category, flag in rows.itertuples(index=False)])
+    return patient_id
+
+def source_hash(conn, patient):
+    """The source_hash given when the patient's results were last imported (convert_lab_trends uses the content
+    hashes of the sheet and of the ranges file), or None"""
+    row = conn.execute('SELECT source_hash FROM patients WHERE name = ?', (patient,)).fetchone()
+    return row[0] if row else None
+
+def query(conn, sql, params=()):
+    return pd.read_sql_query(sql, conn, params=params)
+
+def latest_for_test(conn, test):
+    """Returns every patient's most recent result for one test"""
+    return query(conn, '''
+        SELECT p.name AS patient, t.display_name AS test, r.date, r.result, r.value, r.flag
+        FROM tests t
+        JOIN results r ON r.test_id = t.id
+        JOIN patients p ON p.id = r.patient_id
+        WHERE t.name = ?
+          AND r.date = (SELECT MAX(date) FROM results WHERE patient_id = r.patient_id AND test_id = r.test_id)
+        ORDER BY p.name
+    ''', (test.strip().lower(),))
+
+def patient_results(conn, patient, test=None):
+    """Returns a patient's results in the long format of convert_lab_trends.melt_dataframe, newest first,
+    for every test or just one"""
+    sql = '''
+        SELECT t.display_name AS test, r.result, r.date, r.category, r.flag
+        FROM results r
+        JOIN tests t ON t.id = r.test_id
+        JOIN patients p ON p.id = r.patient_id
+        WHERE p.name = ?
+    '''
+    params = [patient]
+    if test is not None:
+        sql += ' AND t.name = ?'
+        params.append(test.strip().lower())
+    return query(conn, sql + ' ORDER BY t.name, r.date DESC', params)
+
+def patient_latest(conn, patient):
+    """Returns a patient's most recent result for each test"""
+    return query(conn, '''
+        SELECT t.display_name AS test, r.result, r.date, r.category, r.flag
+        FROM results r
+        JOIN tests t ON t.id = r.test_id
+        JOIN patients p ON p.id = r.patient_id
+        WHERE p.name = ?
+          AND r.date = (SELECT MAX(date) FROM results WHERE patient_id = r.patient_id AND test_id = r.test_id)
+        ORDER BY t.name
+    ''', (patient,))
+
+def patient_names(conn):
+    return [name for (name,) in conn.execute('SELECT name FROM patients ORDER BY name')]
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cgm_grid as cgmg
+
+
+def readings(datetimes, glucose):
+    return pd.DataFrame({'Datetime': pd.DatetimeIndex(datetimes), 'Glucose': np.asarray(glucose, dtype=float)})
+
+def test_one_minute_readings_keep_their_spacing():
+    df = readings(pd.date_range('2024-01-01 08:00', periods=60, freq='1min'), np.arange(60) + 100)
+    grid = cgmg.regularize(df)
+    assert cgmg.grid_step(grid) == 1
+    assert len(grid) == 60
+    assert grid['Measured'].all()
+    assert list(grid['Glucose']) == list(df['Glucose'])
+
+def test_step_follows_median_spacing():
+    # Libre historic readings every 15 minutes, with a little jitter
+    datetimes = pd.date_range('2024-01-01', periods=20, freq='15min') + pd.to_timedelta(np.tile([0, 1], 10), unit='min')
+    assert cgmg.sampling_minutes(datetimes) == 15
+    grid = cgmg.regularize(readings(datetimes, np.full(20, 120)))
+    assert cgmg.grid_step(grid) == 15
+    assert not grid['Gap'].any()
+
+def test_max_gap_can_be_set():
+    # Two 5-minute readings half an hour apart
+    df = readings(['2024-01-01 08:00', '2024-01-01 08:05', '2024-01-01 08:35', '2024-01-01 08:40'], [100, 100, 130, 130])
+    assert cgmg.regularize(df)['Gap'].sum() == 5
+    bridged = cgmg.regularize(df, max_gap=30)
+    assert not bridged['Gap'].any()
+    assert bridged['Measured'].sum() == 4
+
+def test_step_must_divide_an_hour():
+    df = readings(pd.date_range('2024-01-01', periods=5, freq='5min'), np.full(5, 100))
+    with pytest.raises(ValueError):
+        cgmg.regularize(df, step=7)
+
+def test_first_and_last_readings_are_measured():
+    # Off the 5-minute clock: the first reading is a minute past a grid point, the last three minutes past one
+    df = readings(['2024-01-01 08:01', '2024-01-01 08:06', '2024-01-01 08:11', '2024-01-01 08:13'], [90, 100, 110, 120])
+    grid = cgmg.regularize(df)
+    assert list(grid['Datetime']) == list(pd.to_datetime(['2024-01-01 08:00', '2024-01-01 08:05', '2024-01-01 08:10', '2024-01-01 08:15']))
+    assert grid['Measured'].all()
+    assert list(grid['Glucose']) == [90, 100, 110, 120]
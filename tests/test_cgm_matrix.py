@@ -0,0 +1,30 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cgm_matrix as cgmm
+
+
+def test_weekday_hour_medians_include_overflow_rows():
+    # Monday 1 January 2024: one reading of 100 at 01:00, and three more repeats of that minute at 200
+    datetimes = pd.to_datetime(['2024-01-01 01:00'] * 4)
+    matrix = cgmm.minute_matrix(datetimes, [100, 200, 200, 200])
+    assert len(matrix.values) == 4
+    assert list(matrix.overflow_days[:, 60]) == [0, 0, 0]
+
+    medians = cgmm.weekday_hour_medians(matrix)
+    assert medians.loc['Monday', 1] == 200
+    assert medians.drop(index='Monday').isna().all().all()
+
+def test_weekday_hour_medians_keep_overflow_on_their_own_day():
+    # A repeated minute on a Tuesday mustn't count towards the Monday it shares an overflow row with
+    datetimes = pd.to_datetime(['2024-01-01 08:30', '2024-01-01 08:30', '2024-01-02 08:30', '2024-01-02 08:30'])
+    matrix = cgmm.minute_matrix(datetimes, [90, 90, 150, 170])
+    medians = cgmm.weekday_hour_medians(matrix)
+    assert medians.loc['Monday', 8] == 90
+    assert medians.loc['Tuesday', 8] == 160
+    assert np.isnan(medians.loc['Wednesday', 8])
@@ -0,0 +1,54 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cgm_grid as cgmg
+import cgm_metrics as cgmx
+
+
+def test_mage_ignores_small_reversals():
+    # A rise from 100 to 200 and a fall to 60, with 2 mg/dL reversals along the way
+    values = np.array([100, 130, 128, 160, 158, 200, 198, 150, 152, 100, 102, 60], dtype=float)
+    sd = values.std(ddof=1)
+    assert list(cgmx.turning_points(values, sd)) == [100, 200, 60]
+    assert cgmx.mage(values, sd) == 120
+
+def test_mage_of_noisy_wave():
+    # Swings of 80 mg/dL between 60 and 140 with +/-3 mg/dL of noise on every reading
+    minutes = np.arange(0, 24 * 60, 5)
+    rng = np.random.default_rng(0)
+    values = 100 + 40 * np.sin(2 * np.pi * minutes / 360) + rng.uniform(-3, 3, len(minutes))
+    sd = values.std(ddof=1)
+    # Four peaks and four nadirs, plus the start of the first rise and the end of the last
+    assert len(cgmx.turning_points(values, sd)) == 10
+    amplitudes = cgmx.excursions(values, sd)
+    assert ((amplitudes[1:-1] > 74) & (amplitudes[1:-1] < 86)).all()
+
+def test_mage_without_excursions():
+    assert np.isnan(cgmx.mage(np.array([100, 101, 100, 101], dtype=float), 10))
+    assert np.isnan(cgmx.mage(np.array([100], dtype=float), np.nan))
+
+def test_glucose_metrics_mage():
+    df = pd.DataFrame({
+        'Datetime': pd.date_range('2024-03-01', periods=12, freq='5min'),
+        'Glucose': [100, 130, 128, 160, 158, 200, 198, 150, 152, 100, 102, 60],
+    })
+    assert cgmx.glucose_metrics(df)['MAGE'] == 120
+
+def test_mage_does_not_span_gaps():
+    # A rise from 100 to 200, then a gap, then readings around 60. The drop across the gap isn't an excursion
+    values = np.array([100, 150, 200, np.nan, np.nan, 60, 61, 60], dtype=float)
+    gap = np.isnan(values)
+    assert list(cgmx.excursions(values, 30, gap)) == [100]
+    assert list(cgmx.excursions(values, 30)) == [100, 140]
+
+def test_glucose_metrics_count_measured_readings():
+    # Readings every 10 minutes on a 5-minute grid: half the points are interpolated
+    datetimes = pd.date_range('2024-01-01', periods=13, freq='10min')
+    grid = cgmg.regularize(pd.DataFrame({'Datetime': datetimes, 'Glucose': np.linspace(100, 160, 13)}), step=5)
+    assert len(grid) == 25
+    assert cgmx.glucose_metrics(grid)['Readings'] == 13
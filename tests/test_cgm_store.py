@@ -0,0 +1,65 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cgm_store as cgmh
+
+
+def readings(start, periods):
+    return pd.DataFrame({'Datetime': pd.date_range(start, periods=periods, freq='5min'),
+                         'Glucose': np.arange(periods, dtype=float) + 100})
+
+def test_appends_only_new_readings(tmp_path):
+    assert cgmh.append_readings('Doe, Jane', readings('2024-01-01', 10), tmp_path) == 10
+    # Overlaps the first five minutes of the next export and fills in one reading before the history
+    assert cgmh.append_readings('Doe, Jane', readings('2023-12-31 23:55', 20), tmp_path) == 10
+    times, glucose = cgmh.open_history('Doe, Jane', tmp_path)
+    assert len(times) == len(glucose) == 20
+    assert (np.diff(times) > 0).all()
+    assert sorted(os.listdir(cgmh.patient_dir('Doe, Jane', tmp_path))) == ['glucose.i16', 'history.json', 'timestamps.i64']
+
+def test_appends_grow_the_files_in_place(tmp_path):
+    cgmh.append_readings('Doe, Jane', readings('2024-01-01', 10), tmp_path)
+    times, _ = cgmh.open_history('Doe, Jane', tmp_path)
+    cgmh.append_readings('Doe, Jane', readings('2024-01-01 00:50', 10), tmp_path)
+    # A map opened before the append still reads the readings it was opened with
+    assert len(times) == 10 and times[0] == pd.Timestamp('2024-01-01').value
+    timestamps_path, glucose_path = cgmh.history_paths('Doe, Jane', tmp_path)
+    assert os.path.getsize(timestamps_path) == 20 * 8
+    assert os.path.getsize(glucose_path) == 20 * 2
+
+def test_unfinished_write_leaves_history_as_it_was(tmp_path):
+    cgmh.append_readings('Doe, Jane', readings('2024-01-01', 10), tmp_path)
+    # Readings written onto the end but the history file never updated
+    timestamps_path, _ = cgmh.history_paths('Doe, Jane', tmp_path)
+    with open(timestamps_path, 'ab') as f:
+        f.write(np.zeros(3, dtype=np.int64).tobytes())
+    times, glucose = cgmh.open_history('Doe, Jane', tmp_path)
+    assert len(times) == len(glucose) == 10
+    assert cgmh.append_readings('Doe, Jane', readings('2024-01-01 00:50', 2), tmp_path) == 2
+    times, _ = cgmh.open_history('Doe, Jane', tmp_path)
+    assert (np.diff(times) > 0).all()
+
+def test_unfinished_backfill_is_finished_on_open(tmp_path):
+    cgmh.append_readings('Doe, Jane', readings('2024-01-01', 10), tmp_path)
+    # The rewritten end saved, but never copied over the arrays
+    times, glucose = cgmh.open_history('Doe, Jane', tmp_path)
+    np.savez(cgmh.tail_file('Doe, Jane', tmp_path), start=5,
+             times=np.insert(np.array(times[5:]), 1, times[5] + 1), glucose=np.insert(np.array(glucose[5:]), 1, 1))
+    times, glucose = cgmh.open_history('Doe, Jane', tmp_path)
+    assert len(times) == len(glucose) == 11
+    assert glucose[6] == 1 and (np.diff(times) > 0).all()
+    assert not os.path.exists(cgmh.tail_file('Doe, Jane', tmp_path))
+
+def test_mismatched_arrays_are_refused(tmp_path):
+    cgmh.append_readings('Doe, Jane', readings('2024-01-01', 10), tmp_path)
+    timestamps_path, _ = cgmh.history_paths('Doe, Jane', tmp_path)
+    with open(timestamps_path, 'r+b') as f:
+        f.truncate(3 * 8)
+    with pytest.raises(ValueError):
+        cgmh.open_history('Doe, Jane', tmp_path)
@@ -0,0 +1,34 @@
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import results_store as rstore
+
+
+def store():
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(rstore.schema)
+    return conn
+
+def sheet(rows):
+    return pd.DataFrame(rows, columns=['test', 'result', 'date'])
+
+def test_reimport_drops_results_taken_off_the_sheet():
+    conn = store()
+    rstore.import_results(conn, 'Doe_Jane', sheet([('PSA', 1.1, '2024-01-05'), ('ApoB', 80, '2024-01-05')]), 'first')
+    rstore.import_results(conn, 'Doe_Jane', sheet([('PSA', 1.2, '2024-01-05')]), 'second')
+    results = rstore.patient_results(conn, 'Doe_Jane')
+    assert list(results['test']) == ['PSA']
+    assert list(results['result']) == ['1.2']
+    assert rstore.source_hash(conn, 'Doe_Jane') == 'second'
+
+def test_duplicate_test_and_date_warns_and_keeps_the_last():
+    conn = store()
+    with pytest.warns(UserWarning, match='psa on 2024-01-05'):
+        rstore.import_results(conn, 'Doe_Jane', sheet([('PSA', 1.1, '2024-01-05'), (' psa', 1.3, '2024-01-05')]))
+    assert list(rstore.patient_results(conn, 'Doe_Jane')['result']) == ['1.3']
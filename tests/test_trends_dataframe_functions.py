@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trends_dataframe_functions as tdf
+
+
+def test_identify_date_columns_matches_is_date():
+    headers = ['test', 'Ref range', '01/05/24', '1/5/24', '2/13/23', '2024-01-05', '1/5/2024', '2024', '13/01/24']
+    df = pd.DataFrame(columns=headers)
+    assert tdf.identify_date_columns(df) == ['01/05/24', '1/5/24', '2/13/23']
+    assert tdf.identify_date_columns(df) == [header for header in headers if tdf.is_date(header)]
@@ -0,0 +1,94 @@
+import hashlib
+import os
+from collections import OrderedDict
+from io import BytesIO
+
+import pandas as pd
+
+
+# Upper bound on the memory held by cached workbook parses, in megabytes
+max_cache_mb = float(os.environ.get('TRENDS_CACHE_MAX_MB', 256))
+
+
+class FrameCache:
+    """Least-recently-used cache of dataframes keyed by a string,
+    evicting the oldest entries once the total size passes max_bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, df):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if key in self._entries:
+            self.total_bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (df, size)
+        self.total_bytes += size
+        self.evict()
+
+    def evict(self):
+        # Always keep the newest entry, even if it alone is over the cap
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+
+# Module-level so the parses survive Streamlit reruns of main_app
+workbook_cache = FrameCache(int(max_cache_mb * 1024 * 1024))
+
+def set_max_cache_mb(megabytes):
+    """Changes the memory cap of the workbook cache, evicting entries if needed"""
+    workbook_cache.max_bytes = int(megabytes * 1024 * 1024)
+    workbook_cache.evict()
+
+def read_file_bytes(file):
+    """Accepts a path or a file-like object (such as a Streamlit upload) and returns its contents"""
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    if hasattr(file, 'read'):
+        file.seek(0)
+        data = file.read()
+        file.seek(0)
+        return data
+    with open(file, 'rb') as f:
+        return f.read()
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def file_content_hash(path, chunk_bytes=1024 * 1024):
+    """content_hash of the file at path, read a chunk at a time rather than all at once"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_trends_excel(file):
+    """Reads a raw lab trends workbook (no header, no index) exactly once per distinct file content.
+    Returns a copy of the cached parse so callers are free to modify it"""
+    data = read_file_bytes(file)
+    key = content_hash(data)
+    df = workbook_cache.get(key)
+    if df is None:
+        df = pd.read_excel(BytesIO(data), parse_dates=True, header=None, index_col=None)
+        workbook_cache.put(key, df)
+    return df.copy()
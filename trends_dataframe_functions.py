@@ -1,6 +1,8 @@
 import pandas as pd
 import re
 from datetime import datetime
+from functools import lru_cache
+from typing import NamedTuple, Optional
 import openpyxl
 import sys
 
@@ -8,10 +10,112 @@ import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
 
+import lab_test_names as ltn
+
 
 # Define a regex pattern to match the 'Lastname, Firstname' format
 name_pattern = r"^(?!.*?\b(?:last\s+name\s*,\s*first\s+name|last\s*,\s*first)\b)\s*[A-Za-z\- '\.]+(, Jr\.?|, Sr\.?|, I{1,3}|, IV|, V|, VI|, VII|, VIII|, IX|, X)?\s*,\s*[A-Za-z\- '\.]+\s*$"
-   
+name_regex = re.compile(name_pattern, re.I)
+
+# Cell that marks the header row of a lab trends export
+header_marker = 'Ref range'
+
+# The header is searched for this many rows at a time, and only this far down before scanning the whole sheet
+header_scan_step = 10
+header_scan_rows = 50
+
+# Size of the top-left corner of a raw sheet used to fingerprint its export template
+fingerprint_rows = 10
+fingerprint_cols = 3
+
+# Layouts of export templates seen so far, keyed by fingerprint
+layout_cache = {}
+
+
+def cell_kind(val):
+    """Returns a one letter code for the type of a raw cell: blank, string, date or number"""
+    if isinstance(val, str):
+        return 's'
+    if isinstance(val, datetime):
+        return 'd'
+    if pd.isna(val):
+        return '-'
+    return 'n'
+
+def layout_fingerprint(df):
+    """Accepts a raw (headerless) trends dataframe and returns a hashable description
+    of the cell types in its top-left corner, which is the same for every sheet from an export template"""
+    corner = df.iloc[:fingerprint_rows, :fingerprint_cols].to_numpy(dtype=object)
+    return corner.shape, tuple(cell_kind(val) for val in corner.ravel())
+
+def find_header_row(df, marker=header_marker):
+    """Returns the (row, column) position of the first cell equal to marker, searching the leading rows
+    a few at a time and stopping at the first match. Returns (0, None) if there is no such cell"""
+    for start in range(0, min(len(df), header_scan_rows), header_scan_step):
+        hits = np.argwhere(df.iloc[start:start + header_scan_step].to_numpy(dtype=object) == marker)
+        if len(hits):
+            return start + int(hits[0][0]), int(hits[0][1])
+
+    # Unusually deep header, fall back to the rest of the sheet
+    hits = np.argwhere(df.iloc[header_scan_rows:].to_numpy(dtype=object) == marker)
+    if len(hits):
+        return header_scan_rows + int(hits[0][0]), int(hits[0][1])
+    return 0, None
+
+def detect_layout(df):
+    """Accepts a raw (headerless) trends dataframe and returns a dict with the header row position
+    and the positions of the reference range and patient name columns.
+    Layouts are cached per export template, so repeat sheets only have their header cell checked"""
+    fingerprint = layout_fingerprint(df)
+    layout = layout_cache.get(fingerprint)
+    if layout is not None:
+        row, col = layout['header_row'], layout['columns']['reference']
+        if col is not None and row < df.shape[0] and col < df.shape[1] and df.iat[row, col] == header_marker:
+            return layout
+
+    row, col = find_header_row(df)
+    name_col = next((i for i, val in enumerate(df.iloc[row]) if isinstance(val, str) and name_regex.match(val.strip())), None)
+    layout = {'header_row': row, 'columns': {'reference': col, 'name': name_col}}
+    if col is not None:
+        layout_cache[fingerprint] = layout
+    return layout
+
+class HeaderInfo(NamedTuple):
+    """What a single column header turned out to be"""
+    header: object
+    is_date: bool
+    timestamp: Optional[pd.Timestamp]
+    # Header as it's displayed, mm/dd/yy for dates
+    label: object
+    # Whole weeks since the previous draw, None for the initial draw and for non-date headers
+    weeks_elapsed: Optional[int]
+
+
+@lru_cache(maxsize=4096, typed=True)
+def parse_header_date(header):
+    """Returns the header as a Timestamp, or None if it isn't a date. Each distinct header is only parsed once"""
+    try:
+        timestamp = pd.to_datetime(header)
+    except Exception:
+        return None
+    if pd.isna(timestamp):
+        return None
+    return timestamp
+
+def classify_headers(headers):
+    """Accepts a sequence of column headers and returns a HeaderInfo for each, in the same order"""
+    timestamps = [parse_header_date(header) for header in headers]
+
+    # Walk the dates from most recent to oldest to find the time elapsed since each previous draw
+    weeks_elapsed = [None] * len(timestamps)
+    newest_first = sorted((i for i, ts in enumerate(timestamps) if ts is not None), key=lambda i: timestamps[i], reverse=True)
+    for newer, older in zip(newest_first, newest_first[1:]):
+        weeks_elapsed[newer] = (timestamps[newer] - timestamps[older]).days // 7
+
+    return [
+        HeaderInfo(header, ts is not None, ts, ts.strftime('%m/%d/%y') if ts is not None else header, weeks)
+        for header, ts, weeks in zip(headers, timestamps, weeks_elapsed)
+    ]
 
 def clean_trends_df(df):
     """Accepts a dataframe that comes from a raw lab trends excel file read by pandas read_csv
@@ -20,7 +124,7 @@ def clean_trends_df(df):
     and replaces NaN data with blank strings"""
 
     # Find the header row (containing 'Ref range')
-    ref_index = df[df.map(lambda x: x == 'Ref range')].any(axis=1).idxmax()
+    ref_index = detect_layout(df)['header_row']
     
     # Set the columns based on the identified header row
     df.columns = df.iloc[ref_index]
@@ -52,18 +156,20 @@ def validate_headers(df):
     valid_columns = []
     
     for col in df.columns:
+        # Headers read as dates are always valid
+        if isinstance(col, datetime):
+            valid_columns.append(col)
+            continue
+
         col_str = str(col).strip()
         
         # Check if the column header matches the 'Lastname, Firstname' format
-        if re.match(name_pattern, col_str, re.I):
+        if name_regex.match(col_str):
             valid_columns.append(col)
         else:
             # Try interpreting the column as a date
-            try:
-                pd.to_datetime(col_str)
+            if parse_header_date(col_str) is not None:
                 valid_columns.append(col)
-            except:
-                pass
 
         # Check if the column header is the 'Reference' column
         if col_str == "Reference":
@@ -76,17 +182,8 @@ def validate_headers(df):
 def format_date_headers(df):
     """Accepts a pandas dataframe, looks for headers that look like dates,
     and converts them to datetime in the format mm/dd/yy"""
-    formatted_headers = []
-    for header in df.columns:
-        try:
-            # Attempt to convert the header to a date and format it
-            formatted_date = pd.to_datetime(header).strftime('%m/%d/%y')
-            formatted_headers.append(formatted_date)
-        except:
-            # If it's not a date or can't be formatted, keep the original header
-            formatted_headers.append(header)
-    
-    df.columns = formatted_headers
+    # Dates are relabelled mm/dd/yy, anything else keeps its original header
+    df.columns = [info.label for info in classify_headers(df.columns)]
     return df
 
 def sort_columns_reverse_chronological(df, reverse_chronological=True):
@@ -94,17 +191,12 @@ def sort_columns_reverse_chronological(df, reverse_chronological=True):
     and then keeps the non-date columns in place while sorting the date columns in reverse-chronological order
     by default, or if indicated, in chronological order"""
     # Identify date columns and non-date columns
-    date_cols = []
-    non_date_cols = []
-    for col in df.columns:
-        try:
-            pd.to_datetime(col)
-            date_cols.append(col)
-        except:
-            non_date_cols.append(col)
+    headers = classify_headers(df.columns)
+    date_cols = [info for info in headers if info.is_date]
+    non_date_cols = [info.header for info in headers if not info.is_date]
 
     # Sort the date columns in reverse chronological order
-    sorted_date_cols = sorted(date_cols, key=pd.to_datetime, reverse=reverse_chronological)
+    sorted_date_cols = [info.header for info in sorted(date_cols, key=lambda info: info.timestamp, reverse=reverse_chronological)]
     
     # Concatenate the columns back together
     sorted_cols = non_date_cols + sorted_date_cols
@@ -122,13 +214,20 @@ def is_convertible_to_float(s):
 def id_category_rows(df):
     """Accepts pandas dataframe and adds a new column called 'category'
     that idenfies rows that are category rows as opposed to data rows"""
-    # Identify category rows
-    def is_blank_or_alpha(val):
-        return pd.isna(val) or isinstance(val, str) and (val.strip() == '' or re.match(r'^[A-Za-z ]+$', val))
-
-    df['is_category'] = df.apply(lambda row: all(is_blank_or_alpha(val) for val in row), axis=1)
-
-    non_category_rows = df[df['is_category'] == False]
+    # A row is a category row when every cell is blank or purely alphabetic
+    is_category = np.ones(len(df), dtype=bool)
+    for i in range(df.shape[1]):
+        values = df.iloc[:, i]
+        blank_or_alpha = values.isna()
+        try:
+            blank_or_alpha |= (values.str.strip() == '').to_numpy(dtype=bool, na_value=False)
+            blank_or_alpha |= values.str.fullmatch(r'[A-Za-z ]+').to_numpy(dtype=bool, na_value=False)
+        except AttributeError:
+            # Column holds no strings at all
+            pass
+        is_category &= blank_or_alpha.to_numpy()
+
+    df['is_category'] = is_category
     
     return df
 
@@ -139,8 +238,18 @@ def is_date(string):
     except ValueError:
         return False
     
+def is_mdy_header(info):
+    """True if a HeaderInfo's header is its date written as m/d/yy, with or without leading zeros,
+    as is_date accepts it"""
+    if not info.is_date or not isinstance(info.header, str):
+        return False
+    parts = info.header.split('/')
+    return (len(parts) == 3 and all(part.isdigit() for part in parts) and len(parts[2]) == 2
+            and [int(part) for part in parts] == [info.timestamp.month, info.timestamp.day, info.timestamp.year % 100])
+
 def identify_date_columns(df):
-    date_columns = [col for col in df.columns if is_date(col)]
+    """Returns the headers that are dates written as m/d/yy (01/05/24 or 1/5/24)"""
+    date_columns = [info.header for info in classify_headers(df.columns) if is_mdy_header(info)]
     return date_columns
 
 def melt_dataframe(df):
@@ -158,51 +267,50 @@ def melt_dataframe(df):
 
     return melted_df
 
+def category_row_mask(df, categories):
+    """Returns a boolean Series that is True for rows whose 'test' value is one of the categories"""
+    return ltn.normalize_test_names(df['test']).isin(categories)
+
 def add_category_column(df,categories):
-    current_category = None
+    """Adds a 'category' column holding the name of the most recent category row above each row"""
+    is_category = category_row_mask(df, categories)
 
-    # Add a new 'category' column to the DataFrame
-    df['category'] = ''
+    # Carry each category row's name forward onto the rows below it
+    category = df['test'].where(is_category).ffill()
 
-    for i, row in df.iterrows():
-        # Check if the row is a category row
-        if str(row['test']).lower() in categories:
-            current_category = row['test']
-        df.loc[i, 'category'] = current_category
+    # Rows above the first category row don't belong to any category
+    df['category'] = category.astype(object).where(category.notna(), None)
     return df
 
 def split_by_category(df, categories):
-    print('TEST',df)
-    dataframes = []
-    current_df = pd.DataFrame(columns=df.columns)
-    current_category = None
-
-    for i, row in df.iterrows():
-        # Check if the row is a category row
-        # The 'test' column is one of the specified categories
-        if str(row['test']).lower() in categories:
-            # If we were already building a DataFrame, append it to the list
-            if current_category is not None:
-                dataframes.append((current_category, current_df))
-
-            # Start a new DataFrame for the new category
-            current_category = row['test']
-            current_df = pd.DataFrame(columns=df.columns)
-        else:
-            # If the row is not a category row, append it to the current DataFrame
-            current_df = pd.concat([current_df, pd.DataFrame(row).T])
+    """Splits the dataframe at each category row and returns a list of (category, dataframe) tuples,
+    one per category row in order, without the category rows themselves"""
+    is_category = category_row_mask(df, categories)
+    category_names = df.loc[is_category, 'test'].tolist()
+
+    # Number each segment by how many category rows precede it
+    segment = is_category.cumsum()
+    data_rows = df[~is_category]
+    segments = dict(tuple(data_rows.groupby(segment[~is_category], sort=False)))
 
-    # Append the last DataFrame to the list, if it is not empty
-    if not current_df.empty:
-        dataframes.append((current_category, current_df))
-    print(dataframes)
+    if not category_names:
+        return [(None, data_rows)] if not data_rows.empty else []
+
+    # Rows above the first category row are discarded
+    dataframes = []
+    for number, category in enumerate(category_names, start=1):
+        current_df = segments.get(number, df.iloc[0:0])
+        # The last category is only kept if it has rows
+        if number == len(category_names) and current_df.empty:
+            continue
+        dataframes.append((category, current_df))
     return dataframes
 
 
 def create_plotly_line_plot_of_metric(dataframe, metric_name):
     df = dataframe
     print(df.columns,metric_name)
-    df = df.query(f'test.str.lower() == @metric_name').replace('',np.nan).dropna()
+    df = df[ltn.matches_test(df['test'], metric_name)].replace('',np.nan).dropna()
     if df.empty:
         return
     df.sort_values(by='date',inplace=True)